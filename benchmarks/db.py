@@ -0,0 +1,70 @@
+"""Contention on the cached TinyDB storage from the threads the bot runs.
+
+An audio-like thread reads config every 20 ms frame, a timer thread keeps flushing, and the event
+loop mixes reads with writes. Reports throughput and read latency for each.
+
+Run from the repository root: python -m benchmarks.db
+"""
+import asyncio
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from tinydb import Query, TinyDB
+
+from cheesebot.db import LockingCachingMiddleware
+from cheesebot.profiler import percentile
+
+DURATION = 5
+PHRASES = 10000
+q = Query()
+
+def report(name: str, samples: list) -> None:
+    print('{:<12} {:>8} ops  p50 {:8.1f} µs  p99 {:8.1f} µs'.format(
+        name, len(samples), percentile(samples, .5) * 1e6, percentile(samples, .99) * 1e6
+    ))
+
+def audio_thread(db: TinyDB, stop: Event, samples: list) -> None:
+    config = db.table('config')
+    while not stop.is_set():
+        start = perf_counter()
+        config.search(q.level_min <= 0)
+        samples.append(perf_counter() - start)
+        sleep(0.02)
+
+async def event_loop(db: TinyDB, stop: Event, reads: list, writes: list) -> None:
+    phrases = db.table('phrases')
+    i = 0
+    while not stop.is_set():
+        start = perf_counter()
+        phrases.get(q.content == str(i % PHRASES))
+        reads.append(perf_counter() - start)
+        start = perf_counter()
+        phrases.update({'notes': str(i)}, q.content == str(i % PHRASES))
+        writes.append(perf_counter() - start)
+        i += 1
+        await asyncio.sleep(0)
+
+def main() -> None:
+    with TemporaryDirectory() as tmp:
+        middleware = LockingCachingMiddleware(TinyDB.DEFAULT_STORAGE, flush_delay=0.1)
+        db = TinyDB(join(tmp, 'storage.json'), storage=middleware)
+        db.table('config').insert({'level_min': 0, 'voice_channel': 'bench'})
+        db.table('phrases').insert_multiple({'set': 'bench', 'content': str(i), 'notes': None} for i in range(PHRASES))
+
+        stop = Event()
+        audio, reads, writes = [], [], []
+        thread = Thread(target=audio_thread, args=(db, stop, audio))
+        thread.start()
+        asyncio.get_event_loop().call_later(DURATION, stop.set)
+        asyncio.get_event_loop().run_until_complete(event_loop(db, stop, reads, writes))
+        thread.join()
+        db.close()
+
+    report('audio read', audio)
+    report('loop read', reads)
+    report('loop write', writes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Local stand-ins for Discord, for driving the bot and its cogs without a connection.
+
+OfflineBot is the real CheeseBot, storage, config, outbox and cogs included, with only the parts
+that talk to Discord replaced: who the bot is, which servers it sees, the message API (FakeAPI,
+which rate limits like Discord) and voice connections (FakeVoiceClient, which records when each
+frame would have been sent).
+"""
+import asyncio
+from collections import defaultdict, deque
+from threading import Event
+from time import perf_counter
+
+from discord import ChannelType, VoiceClient
+from discord.voice_client import StreamPlayer
+
+from cheesebot import CheeseBot, Outbox
+from cheesebot.cogs.audio.streams import FRAME_SIZE
+
+from .outbox import FakeHTTPException, FakeResponse
+
+class FakeVoiceState():
+    def __init__(self, voice_channel: 'FakeChannel' = None) -> None:
+        self.voice_channel = voice_channel
+
+class FakeUser():
+    def __init__(self, id: str, name: str, bot: bool = False, voice_channel: 'FakeChannel' = None) -> None:
+        self.id = id
+        self.name = name
+        self.bot = bot
+        self.voice = FakeVoiceState(voice_channel)
+
+    @property
+    def mention(self) -> str:
+        return '<@{}>'.format(self.id)
+
+    def __str__(self):
+        return self.name
+
+class FakeServer():
+    def __init__(self, id: str, name: str) -> None:
+        self.id = id
+        self.name = name
+        self.channels = []
+
+class FakeChannel():
+    def __init__(self, id: str, name: str, server: FakeServer, type: ChannelType = ChannelType.text) -> None:
+        self.id = id
+        self.name = name
+        self.server = server
+        self.type = type
+        self.voice_members = []
+        server.channels.append(self)
+
+class FakeMessage():
+    def __init__(self, content: str, channel: FakeChannel, author: FakeUser) -> None:
+        self.content = content
+        self.channel = channel
+        self.server = channel.server
+        self.author = author
+
+class FakeAPI():
+    """Sends messages after `latency` seconds, answering 429 above `rate` messages per `per` seconds and channel."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, latency: float = 0.05, rate: int = 5, per: float = 5.0) -> None:
+        self.__loop = loop
+        self.__latency = latency
+        self.__rate = rate
+        self.__per = per
+        self.__windows = defaultdict(deque)
+        self.requests = 0
+        self.rejected = 0
+        self.sent = []
+
+    async def send_message(self, destination: FakeChannel, content=None, **kwargs) -> FakeMessage:
+        await asyncio.sleep(self.__latency)
+        self.requests += 1
+        now = self.__loop.time()
+        window = self.__windows[destination.id]
+        while window and now - window[0] >= self.__per:
+            window.popleft()
+        if len(window) >= self.__rate:
+            self.rejected += 1
+            raise FakeHTTPException(FakeResponse(429, {'Retry-After': '{:.3f}'.format(self.__per - (now - window[0]))}))
+        window.append(now)
+        self.sent.append((destination.id, content))
+        return FakeMessage(content, destination, None)
+
+class _Encoder():
+    # All StreamPlayer needs to know of discord.py's opus encoder.
+    frame_length = 20
+    frame_size = FRAME_SIZE
+
+class FakeVoiceClient(VoiceClient):
+    """A voice connection that notes when each frame is handed over, instead of sending it."""
+
+    def __init__(self, channel: FakeChannel) -> None:
+        # VoiceClient's own constructor expects a gateway connection.
+        self.channel = channel
+        self.frame_times = []
+        self.encoded_frames = 0
+        self.__connected = Event()
+        self.__connected.set()
+
+    def create_stream_player(self, stream, *, after=None) -> StreamPlayer:
+        return StreamPlayer(stream, _Encoder(), self.__connected, self.play_audio, after)
+
+    def play_audio(self, data, encode: bool = True) -> None:
+        self.frame_times.append(perf_counter())
+        if not encode:
+            self.encoded_frames += 1
+
+    def disconnect(self) -> None:
+        self.__connected.clear()
+
+class OfflineBot(CheeseBot):
+    """CheeseBot on `servers`, sending through a FakeAPI and connecting to voice with FakeVoiceClients."""
+
+    def __init__(self, data_path: str, servers: list, api_latency: float = 0.05, **kwargs) -> None:
+        super().__init__(data_path, **kwargs)
+        self.__user = FakeUser('1', 'CheeseBot', bot=True)
+        self.__servers = servers
+        self.__outbox = None
+        self.api = FakeAPI(self.loop, api_latency)
+        self.voice_connections = []
+
+    @property
+    def user(self) -> FakeUser:
+        return self.__user
+
+    @property
+    def servers(self) -> list:
+        return self.__servers
+
+    @property
+    def outbox(self) -> Outbox:
+        if self.__outbox is None:
+            self.__outbox = Outbox(
+                self.api.send_message, self.loop, coalesce_window=self.config.get('reply_coalesce_window', 5)
+            )
+        return self.__outbox
+
+    async def join_voice_channel(self, channel: FakeChannel) -> FakeVoiceClient:
+        voice_client = FakeVoiceClient(channel)
+        channel.voice_members.append(self.user)
+        self.voice_connections.append(voice_client)
+        return voice_client
+
+    def replay_event(self, event: str, *args) -> list:
+        """Hand an event to every cog listening for it, each in its own task like discord.py does."""
+        listener = 'on_{}'.format(event)
+        return [self.loop.create_task(getattr(cog, listener)(*args))
+                for cog in self.cogs.values() if hasattr(cog, listener)]
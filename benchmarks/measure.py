@@ -0,0 +1,57 @@
+"""What the suite records of a benchmark: throughput, latency percentiles and peak memory."""
+import sys
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from cheesebot.profiler import percentile
+
+ROUNDS = 3
+
+def peak_memory() -> int:
+    """The most memory this process has held so far, in bytes, or None where the platform doesn't tell."""
+    if resource is None:
+        return None
+    # Linux reports KiB, macOS bytes.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def time_ops(op: callable, count: int, batch: int = 1, rounds: int = ROUNDS) -> (float, list):
+    """Call `op` `count` times per round; return the total time and the time per call of the fastest round.
+
+    Calls are timed in batches of `batch`, each giving one sample of the time per call. For calls
+    taking about a microsecond or less, timing each on its own mostly measures the timer itself.
+    Taking the best of a few rounds keeps other load on the machine out of the comparison.
+    """
+    best = None
+    for _ in range(rounds):
+        samples = []
+        start = perf_counter()
+        for _ in range(count // batch):
+            batch_start = perf_counter()
+            for _ in range(batch):
+                op()
+            samples.append((perf_counter() - batch_start) / batch)
+        seconds = perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = seconds, samples
+    return best
+
+class Result():
+    def __init__(self, name: str, ops: int, seconds: float, samples: list) -> None:
+        self.name = name
+        self.ops = ops
+        self.seconds = seconds
+        self.throughput = ops / seconds if seconds else 0
+        self.p50 = percentile(samples, .5)
+        self.p99 = percentile(samples, .99)
+        self.peak_memory = peak_memory()
+
+    def to_dict(self) -> dict:
+        return {
+            'ops': self.ops, 'throughput': self.throughput, 'p50': self.p50, 'p99': self.p99,
+            'peak_memory': self.peak_memory,
+        }
@@ -0,0 +1,119 @@
+"""Mention floods sent directly vs. through the Outbox, against a local fake API that answers 429.
+
+The fake API enforces Discord's per-channel limit (5 messages per window) and tells clients
+when to retry. Sending directly retries after each 429 like discord.py does; the Outbox waits
+for its token buckets and coalesces replies to the flood. Time is scaled down: the window is
+half a second instead of five.
+
+Run from the repository root: python -m benchmarks.outbox
+"""
+import asyncio
+from collections import defaultdict, deque
+from time import perf_counter
+
+from cheesebot.outbox import Outbox
+
+CHANNELS = 10
+MENTIONS_PER_CHANNEL = 40
+FLOOD_SECONDS = 2.0
+RATE, PER = 5, 0.5
+
+class FakeResponse():
+    def __init__(self, status: int, headers: dict) -> None:
+        self.status = status
+        self.headers = headers
+
+class FakeHTTPException(Exception):
+    def __init__(self, response: FakeResponse) -> None:
+        self.response = response
+        super().__init__('{} response'.format(response.status))
+
+class FakeAPI():
+    """Just enough HTTP to accept `POST /channels/<id>/messages`, with a sliding window rate limit."""
+
+    def __init__(self) -> None:
+        self.sent = defaultdict(deque)
+        self.requests = 0
+        self.rejected = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        request = await reader.readuntil(b'\r\n\r\n')
+        channel = request.split(b' ')[1].split(b'/')[2]
+        self.requests += 1
+
+        now = perf_counter()
+        sent = self.sent[channel]
+        while sent and now - sent[0] >= PER:
+            sent.popleft()
+        if len(sent) >= RATE:
+            self.rejected += 1
+            retry_after = PER - (now - sent[0])
+            writer.write('HTTP/1.1 429 Too Many Requests\r\nRetry-After: {:.3f}\r\nContent-Length: 0\r\n\r\n'
+                         .format(retry_after).encode())
+        else:
+            sent.append(now)
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+        await writer.drain()
+        writer.close()
+
+async def post(port: int, channel: str, content: str) -> None:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write('POST /channels/{}/messages HTTP/1.1\r\nHost: localhost\r\nContent-Length: {}\r\n\r\n{}'
+                 .format(channel, len(content), content).encode())
+    response = (await reader.readuntil(b'\r\n\r\n')).decode().split('\r\n')
+    writer.close()
+    status = int(response[0].split(' ')[1])
+    headers = dict(line.split(': ', 1) for line in response[1:] if line)
+    if status != 200:
+        raise FakeHTTPException(FakeResponse(status, headers))
+
+async def send_directly(port: int, channel: str, content: str, coalesce=None) -> None:
+    for attempt in range(5):
+        try:
+            return await post(port, channel, content)
+        except FakeHTTPException as e:
+            await asyncio.sleep(float(e.response.headers['Retry-After']))
+
+async def flood(send) -> (float, float):
+    """Mention every channel repeatedly; return the p50 and max time until a reply was settled."""
+    loop = asyncio.get_event_loop()
+    latencies = []
+
+    async def mention(channel: str) -> None:
+        start = perf_counter()
+        await send(channel, 'cheese', coalesce='mention')
+        latencies.append(perf_counter() - start)
+
+    tasks = []
+    for i in range(MENTIONS_PER_CHANNEL):
+        for channel in range(CHANNELS):
+            tasks.append(loop.create_task(mention(str(channel))))
+        await asyncio.sleep(FLOOD_SECONDS / MENTIONS_PER_CHANNEL)
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1]
+
+async def run(name: str, make_send) -> None:
+    api = FakeAPI()
+    server = await asyncio.start_server(api.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    start = perf_counter()
+    p50, worst = await flood(make_send(port))
+    elapsed = perf_counter() - start
+    server.close()
+    await server.wait_closed()
+    print('{:<8} {:4} requests {:4} got 429 {:4} delivered  reply p50 {:6.3f} s  max {:6.3f} s  total {:5.2f} s'
+          .format(name, api.requests, api.rejected, api.requests - api.rejected, p50, worst, elapsed))
+
+def main() -> None:
+    loop = asyncio.get_event_loop()
+    print('{} channels x {} mentions over {} s, {} messages per {} s per channel'.format(
+        CHANNELS, MENTIONS_PER_CHANNEL, FLOOD_SECONDS, RATE, PER
+    ))
+    loop.run_until_complete(run('direct', lambda port: lambda *args, **kwargs: send_directly(port, *args)))
+    loop.run_until_complete(run('outbox', lambda port: Outbox(
+        lambda channel, content: post(port, channel, content), loop, RATE, PER, coalesce_window=PER
+    ).send))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+"""Time per Picker.pick() for bags of 10, 1k and 100k items.
+
+Run from the repository root: python -m benchmarks.picker
+"""
+from time import process_time
+
+from cheesebot import Picker
+
+PICKS = 100000
+
+class ListPicker(Picker):
+    def __init__(self, items: tuple) -> None:
+        self.__items = items
+        super().__init__()
+
+    def _all_items(self):
+        return self.__items
+
+def bench(item_count: int) -> float:
+    picker = ListPicker(tuple(range(item_count)))
+    # The first pick builds the bag, which isn't what we're measuring.
+    picker.pick()
+
+    start = process_time()
+    for _ in range(PICKS):
+        picker.pick()
+    return (process_time() - start) / PICKS
+
+if __name__ == '__main__':
+    for count in (10, 1000, 100000):
+        print('{:>6} items: {:6.2f} µs/pick'.format(count, bench(count) * 1e6))
@@ -0,0 +1,78 @@
+"""Frame-time jitter of local vs. out-of-process mixing, with and without a busy event loop.
+
+A player thread asks for a frame every 20 ms like discord.py's StreamPlayer does, while four
+sound effects keep overlapping the BGM. The "load" runs pure Python work in another thread,
+standing in for the event loop handling messages.
+
+Run from the repository root: python -m benchmarks.remote_mixer
+"""
+import asyncio
+from os import urandom
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from cheesebot.cogs.audio.remote import RemoteMixer
+from cheesebot.cogs.audio.streams import BufferStream, CircularStream, FRAME_SIZE, MappedFile, MultiStream
+
+FRAMES = 250
+SE_COUNT = 4
+
+def busy(stop: Event) -> None:
+    table = {i: {'content': str(i), 'set': str(i % 7)} for i in range(20000)}
+    while not stop.is_set():
+        [row for row in table.values() if row['set'] == '3']
+
+def play(stream) -> (list, list):
+    """Return how late each frame was ready, and how long reading it took."""
+    lateness, read_times = [], []
+    start = perf_counter()
+    for frame in range(1, FRAMES + 1):
+        read_start = perf_counter()
+        stream.read(FRAME_SIZE)
+        now = perf_counter()
+        read_times.append(now - read_start)
+        lateness.append(now - (start + 0.02 * (frame - 1)))
+        sleep(max(0, start + 0.02 * frame - perf_counter()))
+    return lateness, read_times
+
+def summary(samples: list) -> str:
+    samples = sorted(samples)
+    return 'p50 {:6.2f} ms  p99 {:6.2f} ms'.format(samples[len(samples) // 2] * 1e3, samples[int(len(samples) * .99)] * 1e3)
+
+def report(name: str, results: (list, list)) -> None:
+    print('{:<14} late {} | read {}'.format(name, summary(results[0]), summary(results[1])))
+
+def local_stream(bgm: str, se: str) -> MultiStream:
+    stream = MultiStream().add_stream(CircularStream(MappedFile(bgm).view, FRAME_SIZE))
+    for _ in range(SE_COUNT):
+        stream.add_stream(CircularStream(MappedFile(se).view))
+    return stream
+
+def main() -> None:
+    loop = asyncio.new_event_loop()
+    with TemporaryDirectory() as tmp:
+        bgm, se = join(tmp, 'bgm.raw'), join(tmp, 'se.raw')
+        with open(bgm, 'wb') as file:
+            file.write(urandom(FRAME_SIZE * 500))
+        with open(se, 'wb') as file:
+            file.write(urandom(FRAME_SIZE * FRAMES * 2))
+
+        remote = RemoteMixer(bgm, loop, encode=False)
+        for _ in range(SE_COUNT):
+            remote.add_file(se)
+        sleep(1)
+
+        for load in (False, True):
+            stop = Event()
+            if load:
+                Thread(target=busy, args=(stop,), daemon=True).start()
+            report('local' + (' + load' if load else ''), play(local_stream(bgm, se)))
+            report('remote' + (' + load' if load else ''), play(remote))
+            stop.set()
+
+        remote.shutdown()
+
+if __name__ == '__main__':
+    main()
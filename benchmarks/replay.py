@@ -0,0 +1,198 @@
+"""Replays a message flood and voice session against the bot's cogs, end to end but offline.
+
+The bot is real apart from Discord itself (see fake_discord): messages go through MentionCog
+and the outbox to a fake API with Discord's rate limits, and AudioCog plays into fake voice
+connections, pausing and resuming as listeners come and go. Reports how long each message took
+to handle until its reply was settled, how evenly audio frames went out, and the API traffic.
+
+A recording has one JSON event per line, in order of `t` (seconds since the start):
+
+    {"t": 0.25, "event": "message", "channel": "general-3", "mention": true}
+    {"t": 1.0, "event": "voice", "channel": "spooky", "listeners": 2}
+
+Without --recording, a flood is generated, which --record saves for replaying later.
+
+Run from the repository root: python -m benchmarks.replay [--recording FILE] [--record FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+from os.path import join
+from random import Random
+from signal import SIGTERM
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from discord import ChannelType
+
+from cheesebot.bot import INDEXES
+from cheesebot.cogs.audio.streams import BYTES_PER_SECOND
+from cheesebot.db import DB
+from cheesebot.profiler import percentile
+
+from .fake_discord import FakeChannel, FakeMessage, FakeServer, FakeUser, OfflineBot
+from .measure import Result
+
+COGS = ('MentionCog', 'AudioCog')
+SECONDS = 8.0
+CHANNELS = 20
+MESSAGE_RATE = 100
+BURST_RATE = 1000
+BURST = (2.0, 4.0)
+MENTION_SHARE = 0.3
+VOICE_CHANNEL = 'spooky'
+LISTENERS = ((0.5, 2), (3.5, 0), (5.0, 1))
+PHRASE_SETS = ('cheese', 'spooky')
+PHRASES = 1000
+BGM_SECONDS = 10
+# Longer gaps between frames are pauses, not late frames.
+PAUSE_GAP = 0.5
+
+def generate(seed: int = 0) -> list:
+    """Chatter in every channel, a raid during BURST, and listeners joining and leaving."""
+    random = Random(seed)
+    events = [{'t': t, 'event': 'voice', 'channel': VOICE_CHANNEL, 'listeners': listeners}
+              for t, listeners in LISTENERS]
+    t = 0.0
+    while True:
+        t += random.expovariate(BURST_RATE if BURST[0] <= t < BURST[1] else MESSAGE_RATE)
+        if t >= SECONDS:
+            break
+        events.append({
+            'event': 'message', 't': round(t, 4), 'channel': 'general-{}'.format(random.randrange(CHANNELS)),
+            'mention': random.random() < MENTION_SHARE,
+        })
+    events.sort(key=lambda event: event['t'])
+    return events
+
+def load(path: str) -> list:
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def save(events: list, path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as file:
+        file.writelines('{}\n'.format(json.dumps(event)) for event in events)
+
+def prepare(data_path: str, voice_channel: str) -> None:
+    """Write the bot's data: storage with config and phrases, a BGM and a few sound effects of noise."""
+    os.makedirs(join(data_path, 'bgm'))
+    os.makedirs(join(data_path, 'se'))
+    with open(join(data_path, 'bgm', 'stream.raw'), 'wb') as file:
+        file.write(os.urandom(BYTES_PER_SECOND * BGM_SECONDS))
+    for i in range(3):
+        with open(join(data_path, 'se', 'se{}.raw'.format(i)), 'wb') as file:
+            file.write(os.urandom(BYTES_PER_SECOND))
+
+    db = DB(join(data_path, 'storage.json'), True, INDEXES)
+    db.table('config').insert({
+        'level_min': 0, 'voice_channel': voice_channel, 'phrase_sets': list(PHRASE_SETS),
+        'audio_stats_interval': 0, 'decode_workers': 1,
+    })
+    db.table('phrases').insert_multiple({'set': phrase_set, 'content': '{} {}'.format(phrase_set, i), 'notes': None}
+                                        for phrase_set in PHRASE_SETS for i in range(PHRASES))
+    db.close()
+
+def servers_for(events: list) -> list:
+    server = FakeServer('1000', 'replay')
+    names = {event['channel']: event['event'] for event in events}
+    for i, (name, event) in enumerate(sorted(names.items())):
+        FakeChannel(str(2000 + i), name, server, ChannelType.voice if event == 'voice' else ChannelType.text)
+    return [server]
+
+def set_listeners(bot: OfflineBot, channel: FakeChannel, count: int) -> list:
+    """Have people join or leave `channel` until `count` are in it."""
+    tasks = []
+    listeners = [member for member in channel.voice_members if not member.bot]
+    while len(listeners) < count:
+        member = FakeUser('{}-{}'.format(channel.id, len(listeners)), 'listener', voice_channel=channel)
+        listeners.append(member)
+        channel.voice_members.append(member)
+        tasks += bot.replay_event('voice_state_update', FakeUser(member.id, member.name), member)
+    while len(listeners) > count:
+        member = listeners.pop()
+        channel.voice_members.remove(member)
+        tasks += bot.replay_event('voice_state_update', member, FakeUser(member.id, member.name))
+    return tasks
+
+async def replay(bot: OfflineBot, events: list) -> (list, float):
+    """Play `events` in real time; return how long each message took to handle, and the total time."""
+    channels = {channel.name: channel for server in bot.servers for channel in server.channels}
+    author = FakeUser('3000', 'flooder')
+    latencies = []
+    tasks = []
+    start = bot.loop.time()
+    for event in events:
+        delay = start + event['t'] - bot.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        channel = channels[event['channel']]
+        if event['event'] == 'voice':
+            tasks += set_listeners(bot, channel, event['listeners'])
+            continue
+
+        content = '{} cheese?'.format(bot.user.mention) if event['mention'] else 'just chatting'
+        dispatched = perf_counter()
+        for task in bot.replay_event('message', FakeMessage(content, channel, author)):
+            task.add_done_callback(lambda _, dispatched=dispatched: latencies.append(perf_counter() - dispatched))
+            tasks.append(task)
+    await asyncio.gather(*tasks)
+    return latencies, bot.loop.time() - start
+
+def frame_intervals(frame_times: list) -> list:
+    intervals = [b - a for a, b in zip(frame_times, frame_times[1:])]
+    return [interval for interval in intervals if interval < PAUSE_GAP]
+
+def run(events: list) -> list:
+    voice_channel = next((event['channel'] for event in events if event['event'] == 'voice'), VOICE_CHANNEL)
+    with TemporaryDirectory() as tmp:
+        prepare(tmp, voice_channel)
+        bot = OfflineBot(tmp, servers_for(events), journaled=True)
+        for cog in COGS:
+            bot.add_cog(cog)
+        loop = bot.loop
+        loop.run_until_complete(bot.on_ready())
+        loop.run_until_complete(asyncio.gather(*bot.replay_event('ready')))
+
+        latencies, seconds = loop.run_until_complete(replay(bot, events))
+
+        sessions = bot.cogs['AudioCog'].sessions.sessions
+        for cog in bot.cogs.values():
+            cog.shutdown(SIGTERM)
+        loop.run_until_complete(asyncio.sleep(0.1))
+        bot.db.close()
+
+    intervals = [interval for voice_client in bot.voice_connections
+                 for interval in frame_intervals(voice_client.frame_times)]
+    frames = sum(len(voice_client.frame_times) for voice_client in bot.voice_connections)
+    late = sum(1 for interval in intervals if interval > 0.03)
+    print('{} events over {:.1f} s: {} messages, {} API requests ({} got 429), outbox {}'.format(
+        len(events), seconds, len(latencies), bot.api.requests, bot.api.rejected, dict(bot.outbox.stats)
+    ))
+    print('{} frames, {} late, interval p50 {:.1f} ms, p99 {:.1f} ms'.format(
+        frames, late, percentile(intervals, .5) * 1e3, percentile(intervals, .99) * 1e3
+    ))
+    for session in sessions:
+        print('Audio stats for {}: {}'.format(session.channel.name, session.metrics))
+    return [
+        Result('replay_messages', len(latencies), seconds, latencies),
+        Result('replay_frames', frames, seconds, intervals),
+    ]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay a message flood and voice session offline.')
+    parser.add_argument('--recording', help='replay this recording instead of a generated one')
+    parser.add_argument('--record', help='save the generated recording here and exit')
+    args = parser.parse_args()
+    events = load(args.recording) if args.recording else generate()
+    if args.record:
+        save(events, args.record)
+        return
+    for result in run(events):
+        print('{:<16} {:>6} ops  {:8.1f} ops/s  p50 {:8.2f} ms  p99 {:8.2f} ms  peak {:6.1f} MiB'.format(
+            result.name, result.ops, result.throughput, result.p50 * 1e3, result.p99 * 1e3,
+            (result.peak_memory or 0) / 1048576
+        ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""The TinyDB storages vs. the SQLite backend, on a phrases table of growing size.
+
+For each backend: bulk insert, reopening the database, equality lookups on an indexed field,
+a query on a field without index, single updates, closing (which flushes TinyDB to disk),
+and the Python memory held by the open database (SQLite's own page cache isn't counted).
+
+Run from the repository root: python -m benchmarks.sqlite_db
+"""
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+
+from tinydb import Query
+
+from cheesebot.bot import INDEXES
+from cheesebot.db import DB
+from cheesebot.sqlite_db import SQLiteDB
+
+SIZES = (10000, 100000)
+LOOKUPS = 1000
+UPDATES = 50
+q = Query()
+
+BACKENDS = {
+    'json': lambda tmp: DB(join(tmp, 'storage.json'), False, INDEXES),
+    'journal': lambda tmp: DB(join(tmp, 'storage.json'), True, INDEXES),
+    'sqlite': lambda tmp: SQLiteDB(join(tmp, 'storage.sqlite3'), INDEXES),
+}
+
+def timed(func: callable) -> float:
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+
+def run(name: str, open_db: callable, size: int) -> None:
+    with TemporaryDirectory() as tmp:
+        db = open_db(tmp)
+        phrases = [{'set': 'set{}'.format(i % 20), 'content': 'phrase {}'.format(i), 'notes': None} for i in range(size)]
+        insert = timed(lambda: db.table('phrases').insert_multiple(phrases))
+        db.close()
+
+        tracemalloc.start()
+        start = perf_counter()
+        db = open_db(tmp)
+        table = db.table('phrases')
+        table.get(q.content == 'phrase 0')
+        reopen = perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        lookup = timed(lambda: [table.get(q.content == 'phrase {}'.format(i * 7 % size)) for i in range(LOOKUPS)])
+        scan = timed(lambda: table.query(q.notes == 'missing', limit=5))
+        update = timed(lambda: [table.update({'notes': str(i)}, q.content == 'phrase {}'.format(i))
+                                for i in range(UPDATES)])
+        close = timed(db.close)
+
+    print('{:<8} {:>7}  insert {:7.2f} s  reopen {:6.2f} s  get {:7.1f} µs  scan {:7.1f} ms  '
+          'update {:8.1f} µs  close {:6.2f} s  memory {:6.1f} MiB'.format(
+              name, size, insert, reopen, lookup / LOOKUPS * 1e6, scan * 1e3, update / UPDATES * 1e6, close,
+              memory / 1024 / 1024
+          ))
+
+def main() -> None:
+    for size in SIZES:
+        for name, open_db in BACKENDS.items():
+            run(name, open_db, size)
+
+if __name__ == '__main__':
+    main()
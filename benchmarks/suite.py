@@ -0,0 +1,242 @@
+"""Micro-benchmarks of the bot's hot paths plus the offline replay, compared against stored baselines.
+
+The hot paths are mixing a frame (MultiStream), picking a phrase (Picker), reading and writing
+the cached storage (LockingCachingMiddleware), reading and changing config (Config) and handling a
+message (MentionCog.on_message), all on synthetic PCM, phrase and config tables. Each benchmark
+runs in a fresh interpreter, so its peak memory is its own. Results more than --tolerance worse
+than the baselines are flagged, and make the suite exit with status 1.
+
+Baselines depend on the machine, so save them (--save) on the one you compare on.
+
+Run from the repository root: python -m benchmarks.suite [--save] [--tolerance 0.25] [benchmark ...]
+"""
+import argparse
+import asyncio
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from io import BytesIO
+from itertools import count, cycle
+import json
+from os import urandom
+from os.path import dirname, join
+import platform
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+
+from tinydb import Query
+
+from cheesebot import Config, Outbox, PhraseIndex
+from cheesebot.bot import INDEXES
+from cheesebot.cogs import CogFactory
+from cheesebot.cogs.audio.streams import BYTES_PER_SECOND, FRAME_SIZE, CircularStream, MultiStream
+from cheesebot.cogs.cogs import PhrasePicker
+from cheesebot.db import DB
+
+from . import replay
+from .fake_discord import FakeChannel, FakeMessage, FakeServer, FakeUser
+from .measure import ROUNDS, Result, time_ops
+
+BASELINES = join(dirname(__file__), 'baselines.json')
+FRAMES = 3000
+SE_STREAMS = 3
+PHRASE_SETS = ('cheese', 'spooky', 'crackers')
+PHRASES = 10000
+PICKS = 100000
+LOOKUPS = 20000
+UPDATES = 200
+CONFIG_READS = 100000
+CONFIG_WRITES = 2000
+MESSAGES = 50000
+# Calls timed together for the fast benchmarks, which one perf_counter() pair per call can't resolve
+BATCH = 100
+q = Query()
+
+def phrase_db(path: str) -> DB:
+    db = DB(join(path, 'storage.json'), False, INDEXES)
+    db.table('phrases').insert_multiple(
+        {'set': PHRASE_SETS[i % len(PHRASE_SETS)], 'content': 'phrase {}'.format(i), 'notes': None}
+        for i in range(PHRASES)
+    )
+    return db
+
+def bench_mixer() -> list:
+    """One BGM and a few sound effects playing at once."""
+    bgm = CircularStream(memoryview(urandom(BYTES_PER_SECOND * 2)), FRAME_SIZE)
+    stream = MultiStream().add_stream(bgm, source='bgm')
+    for _ in range(SE_STREAMS):
+        stream.add_stream(BytesIO(urandom(FRAME_SIZE * FRAMES * ROUNDS)), source='se')
+    return [Result('mixer', FRAMES, *time_ops(lambda: stream.read(FRAME_SIZE), FRAMES))]
+
+def bench_picker() -> list:
+    with TemporaryDirectory() as tmp:
+        db = phrase_db(tmp)
+        picker = PhrasePicker(PhraseIndex(db.table('phrases')), PHRASE_SETS[0])
+        result = Result('picker', PICKS, *time_ops(picker.pick, PICKS, BATCH))
+        db.close()
+    return [result]
+
+def bench_db() -> list:
+    with TemporaryDirectory() as tmp:
+        db = phrase_db(tmp)
+        phrases = db.table('phrases')
+        contents = cycle('phrase {}'.format(i * 7 % PHRASES) for i in range(PHRASES))
+        get = Result('db_get', LOOKUPS, *time_ops(
+            lambda: phrases.get(q.content == next(contents)), LOOKUPS, BATCH // 10
+        ))
+        update = Result('db_update', UPDATES, *time_ops(
+            lambda: phrases.update({'notes': 'noted'}, q.content == next(contents)), UPDATES
+        ))
+        db.close()
+    return [get, update]
+
+def bench_config() -> list:
+    """Reads of the effective config and writes to a key without handlers, with a few levels set."""
+    with TemporaryDirectory() as tmp:
+        db = DB(join(tmp, 'storage.json'), False, INDEXES)
+        db.table('config').insert_multiple([
+            dict({'key{}'.format(i): i for i in range(30)}, level_min=0),
+            dict({'key{}'.format(i): -i for i in range(10)}, level_min=10),
+            dict({'key{}'.format(i): str(i) for i in range(5)}, level_min=50),
+        ])
+        config = Config(SimpleNamespace(db=db, loop=asyncio.get_event_loop()))
+        config.at_level(50)
+        keys = cycle('key{}'.format(i) for i in range(30))
+        values = count()
+        get = Result('config_get', CONFIG_READS, *time_ops(lambda: config.get(next(keys)), CONFIG_READS, BATCH))
+        write = Result('config_set', CONFIG_WRITES, *time_ops(
+            lambda: config.__setitem__('counter', next(values)), CONFIG_WRITES
+        ))
+        db.close()
+    return [get, write]
+
+def bench_mention() -> list:
+    """MentionCog handling chatter, every fourth message mentioning the bot, with sending left out."""
+    async def send_message(destination, content=None, *, coalesce=None):
+        pass
+
+    with TemporaryDirectory() as tmp:
+        db = phrase_db(tmp)
+        bot = SimpleNamespace(
+            user=FakeUser('1', 'CheeseBot', bot=True), phrases=PhraseIndex(db.table('phrases')),
+            config={'phrase_sets': list(PHRASE_SETS)}, send_message=send_message,
+            outbox=Outbox(send_message, asyncio.get_event_loop())
+        )
+        cog = CogFactory(bot)('MentionCog')
+        channel = FakeChannel('2', 'general', FakeServer('3', 'bench'))
+        author = FakeUser('4', 'chatter')
+        messages = cycle([FakeMessage('{} cheese?'.format(bot.user.mention), channel, author)] +
+                         [FakeMessage('just chatting', channel, author)] * 3)
+
+        def handle() -> None:
+            # Nothing awaited here ever suspends, so the coroutine finishes in one step.
+            try:
+                cog.on_message(next(messages)).send(None)
+            except StopIteration:
+                pass
+
+        result = Result('mention', MESSAGES, *time_ops(handle, MESSAGES, BATCH))
+        db.close()
+    return [result]
+
+BENCHMARKS = OrderedDict([
+    ('mixer', bench_mixer),
+    ('picker', bench_picker),
+    ('db', bench_db),
+    ('config', bench_config),
+    ('mention', bench_mention),
+    ('replay', lambda: replay.run(replay.generate())),
+])
+
+def run_isolated(name: str) -> dict:
+    """Run a benchmark in a new interpreter; return its results by name."""
+    process = subprocess.run([sys.executable, '-m', 'benchmarks.suite', '--child', name],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        print(process.stderr, file=sys.stderr)
+        raise RuntimeError('Benchmark {} failed.'.format(name))
+    return OrderedDict((result.pop('name'), result) for result in map(json.loads, process.stdout.splitlines()))
+
+def run_child(name: str) -> None:
+    # Whatever the code under test prints goes to stderr; stdout is for the results.
+    with redirect_stdout(sys.stderr):
+        results = BENCHMARKS[name]()
+    for result in results:
+        print(json.dumps(dict(result.to_dict(), name=result.name)))
+
+def _duration(seconds: float) -> str:
+    return '{:.2f} ms'.format(seconds * 1e3) if seconds >= 1e-3 else '{:.2f} µs'.format(seconds * 1e6)
+
+def _memory(size: int) -> str:
+    return 'n/a' if size is None else '{:.1f} MiB'.format(size / 1048576)
+
+# Metric, its column, how to show it, and whether more is better
+METRICS = (
+    ('throughput', 'ops/s', '{:.1f}'.format, True),
+    ('p50', 'p50', _duration, False),
+    ('p99', 'p99', _duration, False),
+    ('peak_memory', 'peak memory', _memory, False),
+)
+ROW = '{:<16}' + ' {:>22}' * len(METRICS)
+
+def compare(result: dict, baseline: dict, tolerance: float) -> (list, list):
+    """Format each metric of `result` with its change from `baseline`; return those and the metrics that regressed."""
+    cells = []
+    regressed = []
+    for metric, _, show, more_is_better in METRICS:
+        value, old = result[metric], (baseline or {}).get(metric)
+        if value is None or not old:
+            cells.append('{}        '.format(show(value) if value is not None else 'n/a'))
+            continue
+        change = value / old - 1
+        if (-change if more_is_better else change) > tolerance:
+            regressed.append(metric)
+        cells.append('{} ({:>+5.0%}){}'.format(show(value), change, '!' if metric in regressed else ' '))
+    return cells, regressed
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run the benchmarks and compare them to the baselines.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='any of {} (default: all)'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='how much worse counts as a regression')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmarks: {}'.format(', '.join(unknown)))
+    if args.child:
+        run_child(args.child)
+        return
+
+    try:
+        with open(BASELINES, encoding='utf-8') as file:
+            stored = json.load(file)
+    except FileNotFoundError:
+        stored = {'platform': None, 'results': {}}
+    print('Baselines from {}'.format(stored['platform'] or 'nowhere yet, run with --save to store some'))
+
+    print(ROW.format('', *(column for _, column, _, _ in METRICS)))
+    results = OrderedDict()
+    regressions = []
+    for name in args.benchmarks or BENCHMARKS:
+        for result_name, result in run_isolated(name).items():
+            results[result_name] = result
+            cells, regressed = compare(result, stored['results'].get(result_name), args.tolerance)
+            print(ROW.format(result_name, *cells))
+            regressions += ['{} {}'.format(result_name, metric) for metric in regressed]
+
+    if args.save:
+        stored['platform'] = '{} {}, Python {}'.format(platform.system(), platform.machine(), platform.python_version())
+        stored['results'].update(results)
+        with open(BASELINES, 'w', encoding='utf-8') as file:
+            json.dump(stored, file, indent=4, sort_keys=True)
+            file.write('\n')
+        print('Saved as baselines.')
+    elif regressions:
+        print('More than {:.0%} worse than the baselines: {}'.format(args.tolerance, ', '.join(regressions)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
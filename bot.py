@@ -1,10 +1,12 @@
 import os
 
 from cheesebot import CheeseBot
-from cheesebot.cogs import MentionCog, AudioCog, AdminCog
 
-bot = CheeseBot('{}/data'.format(os.path.realpath(os.path.dirname(__file__))))
-bot.add_cog(MentionCog)
-bot.add_cog(AudioCog)
-bot.add_cog(AdminCog)
-bot.run()
+# Processes started with spawn (like the remote mixer's) import this module too, as __mp_main__.
+if __name__ == '__main__':
+    # Cogs are given by name, so the audio stack is only imported once the bot is connected.
+    bot = CheeseBot('{}/data'.format(os.path.realpath(os.path.dirname(__file__))), journaled=True, fast_start=True)
+    bot.add_cog('MentionCog')
+    bot.add_cog('AudioCog')
+    bot.add_cog('AdminCog')
+    bot.run()
@@ -1,4 +1,7 @@
 from .db import DB
+from .sqlite_db import SQLiteDB
 from .config import Config
 from .picker import Picker
+from .phrases import PhraseIndex
+from .outbox import Outbox
 from .bot import CheeseBot
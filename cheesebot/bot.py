@@ -1,15 +1,72 @@
+import asyncio
+import os
 from signal import getsignal, signal, SIGTERM, SIGINT
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Union
 
 from discord.ext.commands import Bot
 
-from . import Config, DB
+from . import Config, DB, Outbox, PhraseIndex, SQLiteDB
 from .cogs import CogFactory
+from .sqlite_db import migrate
+
+# Fields that the admin commands and config look up by equality
+INDEXES = {
+    'config': ('level_min',),
+    'phrases': ('content', 'set'),
+}
+
+class _StartupTimes():
+    """How long each phase of starting the bot took, for the log."""
+
+    def __init__(self) -> None:
+        self.__start = self.__last = perf_counter()
+        self.__phases = {}
+        self.__reported = False
+
+    def mark(self, phase: str) -> None:
+        """Account the time since the previous mark to `phase`."""
+        now = perf_counter()
+        self.__phases[phase] = self.__phases.get(phase, 0) + now - self.__last
+        self.__last = now
+
+    def record(self, phase: str, seconds: float) -> None:
+        """Note a phase that ran alongside the others."""
+        self.__phases[phase] = seconds
+
+    def report(self) -> None:
+        if self.__reported:
+            return
+        self.__reported = True
+        print('Startup took {:.2f} s: {}'.format(perf_counter() - self.__start, ' | '.join(
+            '{} {:.2f} s'.format(phase, seconds) for phase, seconds in self.__phases.items()
+        )))
 
 class CheeseBot(Bot):
-    def __init__(self, data_path: str):
-        self.__db = DB('{}/storage.json'.format(data_path))
-        self.__config = Config(self)
+    def __init__(self, data_path: str, journaled: bool = False, sqlite: bool = False, fast_start: bool = False):
+        """Keep the data in `data_path`, either in TinyDB (optionally `journaled`) or in SQLite.
+
+        The first time `sqlite` is used, the existing TinyDB database is migrated.
+        With `fast_start`, storage is loaded in the background and cogs are only created once the
+        bot is connected. To log in before storage is loaded, pass the token to run() or set
+        the CHEESEBOT_TOKEN environment variable.
+        """
+        self.__startup = _StartupTimes()
         self.__data_path = data_path
+        self.__db = self.__config = self.__phrases = self.__outbox = None
+        self.__config_lock = Lock()
+        self.__load_error = None
+        self.__pending_cogs = []
+        self.__fast_start = fast_start
+        if fast_start:
+            self.__loader = Thread(target=self.__load_storage, args=(journaled, sqlite), daemon=True)
+            self.__loader.start()
+        else:
+            self.__loader = None
+            self.__load_storage(journaled, sqlite)
+            self.__config = Config(self)
+            self.__startup.mark('storage')
         super().__init__('🧀')
         self.__cog_factory = CogFactory(self)
 
@@ -24,21 +81,108 @@ class CheeseBot(Bot):
                     old_handler(signo, _frame)
 
             signal(sig, stop)
+        self.__startup.mark('init')
 
     @property
-    def db(self) -> DB:
+    def db(self) -> Union[DB, SQLiteDB]:
+        self.__wait_for_storage()
         return self.__db
 
     @property
     def config(self) -> Config:
+        self.__wait_for_storage()
+        if self.__config is None:
+            # Created on the thread using it first, rather than the loader's. Only once, though, or
+            # handlers registered on one that lost the race would never run.
+            with self.__config_lock:
+                if self.__config is None:
+                    self.__config = Config(self)
         return self.__config
 
+    @property
+    def phrases(self) -> PhraseIndex:
+        self.__wait_for_storage()
+        return self.__phrases
+
     @property
     def data_path(self) -> str:
         return self.__data_path
 
-    def add_cog(self, cog_type: type) -> None:
+    @property
+    def outbox(self) -> Outbox:
+        if self.__outbox is None:
+            self.__outbox = Outbox(
+                super().send_message, self.loop, coalesce_window=self.config.get('reply_coalesce_window', 5)
+            )
+        return self.__outbox
+
+    async def send_message(self, destination, content=None, *, coalesce=None, **kwargs):
+        """Send the message through the outbox, so it waits for the rate limits instead of hitting them.
+
+        Returns None if the message was dropped in favour of another one with the same `coalesce` key.
+        """
+        return await asyncio.shield(self.outbox.send(destination, content, coalesce=coalesce, **kwargs))
+
+    def add_cog(self, cog_type: Union[type, str]) -> None:
+        """Add a cog, given its type or its name. With fast start, it is only created once connected."""
+        if self.__fast_start:
+            self.__pending_cogs.append(cog_type)
+            return
         super().add_cog(self.__cog_factory(cog_type))
+        self.__startup.mark('cogs')
+
+    def run(self, token: str = None):
+        self.__startup.mark('setup')
+        token = token or os.environ.get('CHEESEBOT_TOKEN')
+        if token is None:
+            token = self.config['discord_token']
+            self.__startup.mark('waiting for storage')
+        super().run(token)
+
+    async def on_ready(self):
+        self.__startup.mark('login')
+        if self.__loader is not None and self.__loader.is_alive():
+            await self.loop.run_in_executor(None, self.__loader.join)
+            self.__startup.mark('waiting for storage')
+
+        # Cogs added now missed this event, so pass it on to them.
+        pending, self.__pending_cogs = self.__pending_cogs, []
+        for cog_type in pending:
+            cog = self.__cog_factory(cog_type)
+            super().add_cog(cog)
+            if hasattr(cog, 'on_ready'):
+                self.loop.create_task(cog.on_ready())
+        if pending:
+            self.__startup.mark('cogs')
+        self.__startup.report()
+
+    def __load_storage(self, journaled: bool, sqlite: bool) -> None:
+        if self.__fast_start:
+            try:
+                self.__open_storage(journaled, sqlite)
+            except Exception as e:
+                # Raised again to whoever needs the storage.
+                self.__load_error = e
+        else:
+            self.__open_storage(journaled, sqlite)
+
+    def __open_storage(self, journaled: bool, sqlite: bool) -> None:
+        start = perf_counter()
+        json_path = '{}/storage.json'.format(self.__data_path)
+        if sqlite:
+            sqlite_path = '{}/storage.sqlite3'.format(self.__data_path)
+            if not os.path.exists(sqlite_path) and os.path.exists(json_path):
+                migrate(json_path, sqlite_path, INDEXES)
+            db = SQLiteDB(sqlite_path, INDEXES)
+        else:
+            db = DB(json_path, journaled, INDEXES)
+        self.__phrases = PhraseIndex(db.table('phrases'))
+        self.__db = db
+        if self.__fast_start:
+            self.__startup.record('storage (in background)', perf_counter() - start)
 
-    def run(self):
-        super().run(self.__config['discord_token'])
+    def __wait_for_storage(self) -> None:
+        if self.__db is None and self.__loader is not None:
+            self.__loader.join()
+            if self.__load_error is not None:
+                raise self.__load_error
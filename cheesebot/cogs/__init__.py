@@ -1,5 +1,7 @@
 from .. import Picker
 from .cogs import CheeseCog, MentionCog
-from .audio import AudioCog
 from .admin import AdminCog
 from .factory import CogFactory
+
+# AudioCog isn't imported here: the audio stack pulls in numpy, multiprocessing and the voice
+# libraries, so CogFactory only imports it from .audio once an AudioCog is actually created.
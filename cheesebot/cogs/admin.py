@@ -1,21 +1,30 @@
 from collections import defaultdict
+import csv
+import io
+import json
 import re
-from typing import Optional
+from typing import Iterator, Optional
 
 from discord.ext.commands import Command, command, Context
 from tinydb import Query, operations
 
 from . import CheeseCog
 from .. import DB
+from ..profiler import Profiler
 
 q = Query()
 _dict_parse_error = {'__error': RuntimeError}
 _value = r'(str|int|list)\(([^)]*)\)'
 _config_unset = RuntimeError
+_PAGE_SIZE = 5
+_PHRASE_FIELDS = ('set', 'content', 'notes')
+_MAX_PROFILE_SECONDS = 600
+# Discord rejects longer messages
+_MAX_MESSAGE_LENGTH = 2000
 
 def _split_key_value(value):
     pair = value.split('=', 2)
-    return pair[0], Value(pair[1]).value
+    return pair[0], Value(pair[1].rstrip(' ')).value
 
 class Value():
     __re_value = re.compile(_value)
@@ -72,20 +81,91 @@ class AdminCommand(Command):
 def _admin_command(func):
     return command(cls=AdminCommand)(func)
 
+def _admin_context_command(func):
+    return command(cls=AdminCommand, pass_context=True)(func)
+
+def _parse_phrases(filename: str, data: bytes) -> list:
+    """Read phrases from a JSON list of objects, or a CSV file with a header row."""
+    text = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        rows = json.loads(text)
+        if not isinstance(rows, list):
+            raise ValueError('expected a list of phrases')
+        return rows
+    if filename.lower().endswith('.csv'):
+        return list(csv.DictReader(io.StringIO(text)))
+    raise ValueError('expected a `.json` or `.csv` file')
+
+def _dump_phrases(rows, file_format: str) -> bytes:
+    if file_format == 'json':
+        return json.dumps([dict(row) for row in rows], ensure_ascii=False, indent=2).encode()
+    text = io.StringIO()
+    writer = csv.DictWriter(text, _PHRASE_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return text.getvalue().encode()
+
+class _Cursor():
+    """A db_inspect scan, paused after the rows shown so far."""
+
+    def __init__(self, table: str, rows: Iterator) -> None:
+        self.table = table
+        self.shown = 0
+        self.__rows = rows
+        self.__next = next(rows, None)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.__next is None
+
+    def page(self, size: int) -> list:
+        rows = []
+        while self.__next is not None and len(rows) < size:
+            rows.append(self.__next)
+            self.__next = next(self.__rows, None)
+        self.shown += len(rows)
+        return rows
+
 class Maintenance(CheeseCog):
+    def __init__(self, bot: 'cheesebot.CheeseBot') -> None:
+        super().__init__(bot)
+        self.__cursor = None
+
     @_admin_command
     async def db_inspect(self, table: str = None, *, where: StrDict = StrDict('')) -> None:
+        where = dict(where)
+        fields = where.pop('_fields', None)
         query = await self.__get_query(table, where)
         if query is None:
             return
-        rows = self.bot.db.table(table).search(query)
-        footer = ''
-        if len(rows) > 5:
-            footer = '\n(Showing top 5 results out of {})'.format(len(rows))
-            rows = rows[:5]
-        if not len(rows):
+        if isinstance(fields, str):
+            fields = [fields]
+
+        self.__cursor = _Cursor(table, self.bot.db.table(table).scan(query, fields and tuple(fields)))
+        if self.__cursor.exhausted:
+            self.__cursor = None
             await self.bot.say('No matches found in table `{}`'.format(table))
             return
+        await self.__show_page()
+
+    @_admin_command
+    async def db_next(self) -> None:
+        if self.__cursor is None:
+            await self.bot.say('There are no more results. Use `{}db_inspect` first.'.format(self.bot.command_prefix))
+            return
+        await self.__show_page()
+
+    async def __show_page(self) -> None:
+        cursor = self.__cursor
+        first = cursor.shown + 1
+        rows = cursor.page(_PAGE_SIZE)
+        footer = ''
+        if cursor.exhausted:
+            self.__cursor = None
+        else:
+            footer = '\n(Showing results {}-{} from `{}`. Use `{}db_next` for more.)'.format(
+                first, cursor.shown, cursor.table, self.bot.command_prefix
+            )
         await self.bot.say('```{}```{}'.format('\n\n'.join(
             '\n'.join('{}:\n    {}'.format(k, v) for k, v in row.items()) for row in rows
         ), footer))
@@ -109,9 +189,13 @@ class Maintenance(CheeseCog):
         except:
             await self.bot.say('Oops! Something went wrong!\nNote that some operations don\'t expect a value.')
             return
+        if table == 'phrases':
+            self.bot.phrases.reload()
+        elif table == 'config':
+            self.bot.config.reload()
         await self.bot.say('{} records in `{}` have been updated.'.format(len(ids), table))
 
-    async def __get_query(self, table: str, where: StrDict) -> Optional[list]:
+    async def __get_query(self, table: str, where: dict) -> Optional[list]:
         all_tables = filter(lambda s: s[0] != '_', self.bot.db.tables())
         if table is None:
             await self.bot.say('The following tables are available:\n`{}`'.format('`, `'.join(all_tables)))
@@ -130,6 +214,42 @@ class Maintenance(CheeseCog):
             query &= q[k] == v
         return query
 
+class Diagnostics(CheeseCog):
+    def __init__(self, bot: 'cheesebot.CheeseBot') -> None:
+        super().__init__(bot)
+        self.__profiler = None
+
+    @_admin_command
+    async def profile(self, seconds: int = 10) -> None:
+        if self.__profiler is None:
+            self.__profiler = Profiler(self.bot.loop, '{}/profiles'.format(self.bot.data_path))
+        if self.__profiler.running:
+            await self.bot.say('Already profiling. Use `{}profile_stop` to stop early.'.format(self.bot.command_prefix))
+            return
+
+        seconds = max(1, min(seconds, _MAX_PROFILE_SECONDS))
+        await self.bot.say('Profiling all threads and the event loop for {} s.'.format(seconds))
+        report = await self.__profiler.run(seconds)
+        await self.bot.say('```{}```'.format(str(report)[:_MAX_MESSAGE_LENGTH - 6]))
+
+    @_admin_command
+    async def profile_stop(self) -> None:
+        if self.__profiler is None or not self.__profiler.running:
+            await self.bot.say('Not profiling right now.')
+            return
+        self.__profiler.stop()
+
+    @_admin_command
+    async def audio_stats(self) -> None:
+        audio = self.bot.get_cog('AudioCog')
+        if audio is None or not audio.sessions.sessions:
+            await self.bot.say('No audio is playing.')
+            return
+
+        await self.bot.say('\n'.join('`{}`:```{}```'.format(
+            session.channel.name, str(session.metrics).replace(' | ', '\n')
+        ) for session in audio.sessions.sessions))
+
 class Configuration(CheeseCog):
     @_admin_command
     async def config_get(self, key: str, level: int = 0) -> None:
@@ -153,13 +273,13 @@ class Configuration(CheeseCog):
 class Phrases(CheeseCog):
     @_admin_command
     async def phrase_add(self, set_name: str, content: str, notes: str = None) -> None:
-        table = self.bot.db.table('phrases')
-        existing = table.get(q.content == content)
-        if existing:
-            await self.bot.say('Phrase already exists in set `{}`! Be a little more creative :)'.format(existing['set']))
+        existing = self.bot.phrases.set_of(content)
+        if existing is not None:
+            await self.bot.say('Phrase already exists in set `{}`! Be a little more creative :)'.format(existing))
             return
 
-        table.insert({'set': set_name, 'content': content, 'notes': notes})
+        self.bot.db.table('phrases').insert({'set': set_name, 'content': content, 'notes': notes})
+        self.bot.phrases.add(set_name, content)
         await self.bot.say('Added the phrase to set `{}`.'.format(set_name))
 
     @_admin_command
@@ -167,6 +287,7 @@ class Phrases(CheeseCog):
         if not self.bot.db.table('phrases').update({'set': set_name}, q.content == content):
             await self.bot.say('Phrase could _not_ be moved to set `{}`.'.format(set_name))
             return
+        self.bot.phrases.move(content, set_name)
 
         await self.bot.say('Phrase was successfully moved to set `{}`.'.format(set_name))
 
@@ -183,6 +304,7 @@ class Phrases(CheeseCog):
         if not self.bot.db.table('phrases').remove(q.content == content):
             await self.bot.say('Phrase could _not_ be removed.')
             return
+        self.bot.phrases.remove(content)
 
         await self.bot.say('Phrase was successfully removed.')
 
@@ -200,14 +322,73 @@ class Phrases(CheeseCog):
     @_admin_command
     async def phrase_set_move(self, old_name: str, new_name: str) -> None:
         ids = self.bot.db.table('phrases').update({'set': new_name}, q.set == old_name)
+        self.bot.phrases.move_set(old_name, new_name)
 
         await self.bot.say('{} phrases were moved from step `{}` to step `{}`.'.format(len(ids), old_name, new_name))
 
     @_admin_command
     async def phrase_set_remove(self, set_name: str) -> None:
         ids = self.bot.db.table('phrases').remove(q.set == set_name)
+        self.bot.phrases.remove_set(set_name)
 
         await self.bot.say('{} phrase were removed from step `{}`.'.format(len(ids), set_name))
 
-class AdminCog(Maintenance, Configuration, Phrases):
+    @_admin_context_command
+    async def phrase_import(self, ctx: Context) -> None:
+        if not ctx.message.attachments:
+            await self.bot.say('Attach a `.json` or `.csv` file with the `{}` of each phrase.'.format(
+                '`, `'.join(_PHRASE_FIELDS)
+            ))
+            return
+        attachment = ctx.message.attachments[0]
+        try:
+            async with self.bot.http.session.get(attachment['url']) as response:
+                data = await response.read()
+            rows = _parse_phrases(attachment['filename'], data)
+        except Exception as e:
+            await self.bot.say('Could not read `{}`: {}'.format(attachment['filename'], e))
+            return
+
+        # One pass over the file, looking up each phrase by its hash, then one write for all of them.
+        documents = []
+        seen = set()
+        existing = repeated = invalid = 0
+        for row in rows:
+            if not isinstance(row, dict) or not all(isinstance(row.get(key), str) and row[key]
+                                                    for key in ('set', 'content')):
+                invalid += 1
+                continue
+            content = row['content']
+            if content in seen:
+                repeated += 1
+                continue
+            seen.add(content)
+            if self.bot.phrases.set_of(content) is not None:
+                existing += 1
+                continue
+            documents.append({'set': row['set'], 'content': content, 'notes': row.get('notes') or None})
+
+        if documents:
+            self.bot.db.table('phrases').insert_multiple(documents)
+            for document in documents:
+                self.bot.phrases.add(document['set'], document['content'])
+
+        await self.bot.say(
+            'Imported {} phrases. Skipped {} that already existed, {} repeated ones and {} invalid rows.'
+            .format(len(documents), existing, repeated, invalid)
+        )
+
+    @_admin_command
+    async def phrase_export(self, file_format: str = 'json', set_name: str = None) -> None:
+        if file_format not in ('json', 'csv'):
+            await self.bot.say('Invalid format `{}`. Expected `json` or `csv`.'.format(file_format))
+            return
+
+        rows = self.bot.db.table('phrases').scan(set_name and q.set == set_name or None, _PHRASE_FIELDS)
+        await self.bot.upload(
+            io.BytesIO(_dump_phrases(rows, file_format)),
+            filename='{}.{}'.format(set_name or 'phrases', file_format)
+        )
+
+class AdminCog(Maintenance, Diagnostics, Configuration, Phrases):
     pass
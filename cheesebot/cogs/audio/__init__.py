@@ -1,12 +1,20 @@
-from glob import glob
 from .. import CheeseCog, Picker
+from .se_index import SEIndex
 
 class SEPicker(Picker):
     def __init__(self, path: str) -> None:
-        self.__path = path
+        self.__index = SEIndex(path)
+        self.__index.start()
         super().__init__()
 
+    @property
+    def index(self) -> SEIndex:
+        return self.__index
+
     def _all_items(self):
-        return glob('{}/*.raw'.format(self.__path))
+        return self.__index.items
+
+    def shutdown(self, signal: int) -> None:
+        self.__index.shutdown(signal)
 
 from .cog import AudioCog
@@ -1,58 +1,73 @@
+from asyncio import sleep
 from glob import glob
-from os import stat
 
 from discord import Channel, ChannelType, VoiceClient, utils
-from discord.voice_client import StreamPlayer
 
 from .. import CheeseCog
 from ... import Picker
 from . import SEPicker
-from .se_player import SEPlayer
-from .streams import CircularStream, MultiStream
+from .se_cache import SECache
+from .sessions import SessionManager
 
 class AudioCog(CheeseCog):
-    def __init__(self, bot: 'cheesebot.CheeseBot', voice_channel: str, bgm: str, se_picker: SEPicker):
+    def __init__(self, bot: 'cheesebot.CheeseBot', voice_channel: str, bgm: str, se_picker: SEPicker, se_cache: SECache,
+                 decode_workers: int = 2, remote_mixing: bool = False):
         super().__init__(bot)
         self.__voice_channel = voice_channel
-        self.__bgm = bgm
         self.__se_picker = se_picker
+        self.__sessions = SessionManager(bgm, se_picker, se_cache, bot.loop, decode_workers, remote_mixing)
+        self.__metrics_task = None
+
+    @property
+    def sessions(self) -> SessionManager:
+        return self.__sessions
 
     async def on_ready(self):
         print('Logged in as {} (ID {})'.format(self.bot.user, self.bot.user.id))
-        channel, stream = await self.__setup_bgm()
-        if channel is not None:
-            print('Now playing spoopy music in {}'.format(channel.name))
-            SEPlayer(stream, self.__se_picker).start()
-        else:
+        for channel in self.__find_channels():
+            # This runs again after every reconnect, when the sessions are still there.
+            if self.__sessions.get(channel) is not None:
+                continue
+            voice_client = await self.bot.join_voice_channel(channel)  # type: discord.VoiceClient
+            assert isinstance(voice_client, VoiceClient)
+            self.__sessions.start(channel, voice_client)
+            print('Now playing spoopy music in {} on {}'.format(channel.name, channel.server.name))
+
+        if not self.__sessions.sessions:
             print('Voice channel "{}" not found.'.format(self.__voice_channel))
+            return
+
+        interval = self.bot.config.get('audio_stats_interval', 300)
+        if interval and self.__metrics_task is None:
+            self.__metrics_task = self.bot.loop.create_task(self.__log_metrics(interval))
+
+    async def on_voice_state_update(self, before, after):
+        # Someone left one channel and/or joined another; either could have a session.
+        for member in (before, after):
+            if member.voice.voice_channel is not None:
+                self.__sessions.update_presence(member.voice.voice_channel)
+
+    def shutdown(self, signal: int):
+        if self.__metrics_task is not None:
+            self.bot.loop.call_soon_threadsafe(self.__metrics_task.cancel)
+        self.__sessions.shutdown(signal)
+        self.__se_picker.shutdown(signal)
 
-    async def __setup_bgm(self) -> (Channel, MultiStream):
-        channel = None  # type: discord.Channel
+    async def __log_metrics(self, interval: int) -> None:
+        while True:
+            await sleep(interval)
+            for session in self.__sessions.sessions:
+                print('Audio stats for {}: {}'.format(session.channel.name, session.metrics))
 
+    def __find_channels(self) -> list:
+        # Only one voice connection per server is possible, so take the first match on each.
+        channels = []
         for server in self.bot.servers:
             channel = utils.find(
                 lambda c: c.name.find(self.__voice_channel) >= 0 and
                         c.type is ChannelType.voice,
                 server.channels
-            )
+            )  # type: discord.Channel
             if channel is not None:
-                break
-
-        if channel is None:
-            return None
-
-        voice_client = await self.bot.join_voice_channel(channel)  # type: discord.VoiceClient
-        assert isinstance(voice_client, VoiceClient)
-
-        try:
-            blksize = stat(self.__bgm).st_blksize
-        except AttributeError:
-            blksize = 4096
-
-        audio = open(self.__bgm, 'rb', 0)
-        stream = MultiStream().add_stream(CircularStream(audio, 1000 * blksize))
-        player = voice_client.create_stream_player(stream)  # type: discord.voice_client.StreamPlayer
-        assert isinstance(player, StreamPlayer)
-        player.start()
-
-        return channel, stream
+                channels.append(channel)
+        return channels
@@ -0,0 +1,159 @@
+from asyncio import AbstractEventLoop, CancelledError, Event, sleep
+from collections import deque, namedtuple
+from concurrent.futures import Executor
+import wave
+
+import numpy
+
+from .streams import BYTES_PER_SECOND
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+OUTPUT_RATE = 48000
+RAW_SUFFIX = '.raw'
+COMPRESSED_SUFFIXES = ('.flac', '.ogg', '.wav')
+# Without soundfile, only WAV can be decoded.
+DECODABLE_SUFFIXES = COMPRESSED_SUFFIXES if soundfile is not None else ('.wav',)
+
+AudioInfo = namedtuple('AudioInfo', ['rate', 'channels', 'frames'])
+
+def is_compressed(path: str) -> bool:
+    return path.lower().endswith(COMPRESSED_SUFFIXES)
+
+def audio_info(path: str) -> AudioInfo:
+    if soundfile is not None:
+        info = soundfile.info(path)
+        return AudioInfo(info.samplerate, info.channels, info.frames)
+    if path.lower().endswith('.wav'):
+        with wave.open(path) as file:
+            return AudioInfo(file.getframerate(), file.getnchannels(), file.getnframes())
+    raise ValueError('Decoding {} needs the soundfile package.'.format(path))
+
+def decode_chunk(path: str, start: int, count: int) -> (bytes, bool):
+    """Decode `count` frames from `start` on into 48 kHz 16 bit stereo PCM. Runs in a worker process.
+
+    Returns the PCM data and whether the end of the file was reached.
+    """
+    if soundfile is not None:
+        with soundfile.SoundFile(path) as file:
+            file.seek(start)
+            samples = file.read(count, dtype='int16', always_2d=True)
+            rate, end = file.samplerate, file.frames
+    elif path.lower().endswith('.wav'):
+        with wave.open(path) as file:
+            file.setpos(start)
+            data = file.readframes(count)
+            rate, end, channels = file.getframerate(), file.getnframes(), file.getnchannels()
+            samples = _from_wave(data, file.getsampwidth()).reshape(-1, channels)
+    else:
+        raise ValueError('Decoding {} needs the soundfile package.'.format(path))
+
+    return _to_output(samples, rate).tobytes(), start + len(samples) >= end
+
+def _from_wave(data: bytes, width: int) -> numpy.ndarray:
+    if width == 1:
+        return (numpy.frombuffer(data, numpy.uint8).astype(numpy.int16) - 128) << 8
+    if width == 2:
+        return numpy.frombuffer(data, numpy.int16)
+    if width == 4:
+        return (numpy.frombuffer(data, numpy.int32) >> 16).astype(numpy.int16)
+    raise ValueError('Unsupported WAV sample width: {} bytes'.format(width))
+
+def _to_output(samples: numpy.ndarray, rate: int) -> numpy.ndarray:
+    if samples.shape[1] == 1:
+        samples = numpy.repeat(samples, 2, axis=1)
+    elif samples.shape[1] > 2:
+        samples = samples[:, :2]
+    if rate != OUTPUT_RATE and len(samples):
+        # Linear interpolation is plenty for background music and sound effects.
+        positions = numpy.arange(0, len(samples), rate / OUTPUT_RATE)
+        samples = numpy.stack([
+            numpy.interp(positions, numpy.arange(len(samples)), samples[:, channel]) for channel in (0, 1)
+        ], axis=1).astype(numpy.int16)
+    return numpy.ascontiguousarray(samples, numpy.int16)
+
+class DecodedStream():
+    """Plays a compressed file, decoded chunk by chunk in a process pool ahead of the reader.
+
+    At most `buffer_seconds` of decoded audio are kept. Reads never wait for the decoder: if it
+    falls behind, silence is returned until it catches up.
+    """
+
+    def __init__(self, path: str, pool: Executor, loop: AbstractEventLoop, looping: bool = False,
+                 buffer_seconds: float = 4, chunk_seconds: float = 1) -> None:
+        self.__path = path
+        self.__pool = pool
+        self.__loop = loop
+        self.__looping = looping
+        self.__capacity = int(buffer_seconds * BYTES_PER_SECOND)
+        self.__chunk_seconds = chunk_seconds
+        self.__chunks = deque()
+        self.__current = memoryview(b'')
+        # Written by the decoding task and the audio thread respectively, so neither needs a lock.
+        self.__produced = 0
+        self.__consumed = 0
+        self.__finished = False
+        self.__ready = Event()
+        self.__task = loop.create_task(self.__fill())
+
+    async def ready(self) -> None:
+        """Wait until there's something to play, so playback doesn't start with silence."""
+        await self.__ready.wait()
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.__produced - self.__consumed
+        parts = []
+        remaining = size
+        while remaining:
+            if not self.__current:
+                try:
+                    self.__current = memoryview(self.__chunks.popleft())
+                except IndexError:
+                    break
+            part = self.__current[:remaining]
+            self.__current = self.__current[len(part):]
+            parts.append(part)
+            remaining -= len(part)
+        self.__consumed += size - remaining
+
+        # A short read ends the stream, so only return one once the decoder is done for good.
+        if remaining and not self.__finished:
+            parts.append(bytes(remaining))
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def close(self) -> None:
+        self.__loop.call_soon_threadsafe(self.__task.cancel)
+
+    async def __fill(self) -> None:
+        try:
+            info = await self.__loop.run_in_executor(self.__pool, audio_info, self.__path)
+            if not info.frames:
+                raise ValueError('No audio found.')
+            chunk_frames = max(1, int(info.rate * self.__chunk_seconds))
+            position = 0
+            while True:
+                if self.__produced - self.__consumed >= self.__capacity:
+                    await sleep(self.__chunk_seconds / 2)
+                    continue
+                data, end = await self.__loop.run_in_executor(
+                    self.__pool, decode_chunk, self.__path, position, chunk_frames
+                )
+                position += chunk_frames
+                if data:
+                    self.__chunks.append(data)
+                    self.__produced += len(data)
+                    self.__ready.set()
+                if end:
+                    if not self.__looping:
+                        break
+                    position = 0
+        except CancelledError:
+            raise
+        except Exception as e:
+            print('Could not decode {}: {}'.format(self.__path, e))
+        self.__finished = True
+        self.__ready.set()
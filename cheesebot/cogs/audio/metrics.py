@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+class Histogram():
+    """Counts durations in power-of-two microsecond buckets, which keeps recording cheap enough
+    for the audio thread."""
+
+    def __init__(self) -> None:
+        self.counts = [0] * 32
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds: float) -> None:
+        us = int(seconds * 1000000)
+        self.counts[min(us.bit_length(), 31)] += 1
+        self.total += 1
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, p: float) -> int:
+        """Upper bound (in µs) of the bucket containing the p-th percentile."""
+        threshold = p * self.total
+        running = 0
+        for bucket, count in enumerate(self.counts):
+            running += count
+            if count and running >= threshold:
+                return 1 << bucket
+        return 0
+
+    def __str__(self):
+        if not self.total:
+            return 'n/a'
+        return 'p50 <{}µs p99 <{}µs max {}µs'.format(self.percentile(.5), self.percentile(.99), self.max)
+
+class AudioMetrics():
+    """Timings and counters of the audio pipeline.
+
+    Only the audio thread writes the frame related values, so they're plain attributes without locking.
+    """
+
+    def __init__(self) -> None:
+        self.mix_time = Histogram()
+        self.se_latency = Histogram()
+        self.resume_latency = Histogram()
+        self.frames = 0
+        self.encoded_frames = 0
+        self.underruns = 0
+        self.active_streams = 0
+        self.bytes_read = defaultdict(int)
+        self.paused = False
+
+    def __str__(self):
+        return ' | '.join((['paused'] if self.paused else []) + [
+            'frames {} ({} pre-encoded)'.format(self.frames, self.encoded_frames),
+            'mix {}'.format(self.mix_time),
+            'underruns {}'.format(self.underruns),
+            'streams {}'.format(self.active_streams),
+            'SE start {}'.format(self.se_latency),
+            'resume {}'.format(self.resume_latency),
+            'read {}'.format(', '.join(
+                '{} {:.1f} MiB'.format(k, v / 1048576) for k, v in sorted(self.bytes_read.items())
+            ) or 'n/a'),
+        ])
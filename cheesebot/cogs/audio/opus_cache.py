@@ -0,0 +1,84 @@
+from array import array
+from mmap import mmap, ACCESS_READ
+import os
+import struct
+
+from discord.opus import Encoder
+
+from .streams import CircularStream, MAX_GAIN, Mixer
+
+# Magic, frame size, frame count, the source's size and mtime to tell when the cache is stale, then the gain
+_HEADER = struct.Struct('=8sIIQQd')
+_MAGIC = b'CHSOPUS2'
+
+class OpusCache():
+    """Opus packets for every frame of a looped PCM file, memory mapped from a cache file.
+
+    The file consists of a header, a table of frame count + 1 uint32 offsets, and the packets.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self.__map = mmap(file.fileno(), 0, access=ACCESS_READ)
+        view = memoryview(self.__map)
+        magic, self.frame_size, count, self.source_size, self.source_mtime, self.gain = _HEADER.unpack_from(view)
+        if magic != _MAGIC:
+            raise ValueError('{} is not an Opus frame cache.'.format(path))
+        table_end = _HEADER.size + 4 * (count + 1)
+        self.__offsets = view[_HEADER.size:table_end].cast('I')
+        self.__packets = view[table_end:]
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+    def __getitem__(self, index: int) -> memoryview:
+        return self.__packets[self.__offsets[index]:self.__offsets[index + 1]]
+
+    def close(self) -> None:
+        self.__offsets.release()
+        self.__packets.release()
+        self.__map.close()
+
+    def is_fresh_for(self, source: str, frame_size: int) -> bool:
+        """Whether this cache was built from `source` as it is now, for the frame size and gain we play at."""
+        st = os.stat(source)
+        return ((self.source_size, self.source_mtime, self.frame_size, self.gain) ==
+                (st.st_size, st.st_mtime_ns, frame_size, MAX_GAIN))
+
+    @classmethod
+    def load_or_build(cls, source: str, pcm, frame_size: int) -> 'OpusCache':
+        """Load the cache for `source` (whose contents are `pcm`), (re)building it if needed."""
+        path = '{}.opus'.format(source)
+        try:
+            cache = cls(path)
+            if cache.is_fresh_for(source, frame_size):
+                return cache
+        except (OSError, ValueError, struct.error):
+            pass
+        cls.build(source, pcm, frame_size, path)
+        return cls(path)
+
+    @staticmethod
+    def build(source: str, pcm, frame_size: int, path: str) -> None:
+        # Same settings as discord.py's voice client, so cached and live frames sound alike.
+        encoder = Encoder(48000, 2)
+        mixer = Mixer()
+        samples_per_frame = frame_size // 4
+        stream = CircularStream(pcm, frame_size)
+        count = -(-len(pcm) // frame_size)
+
+        offsets = array('I', [0])
+        packets = bytearray()
+        for _ in range(count):
+            # At the gain MultiStream mixes a lone stream at, so the BGM doesn't get louder between sound effects.
+            frame = mixer.mix([(stream.read(frame_size), MAX_GAIN)], frame_size)
+            packets += encoder.encode(frame, samples_per_frame)
+            offsets.append(len(packets))
+
+        st = os.stat(source)
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, frame_size, count, st.st_size, st.st_mtime_ns, MAX_GAIN))
+            file.write(offsets.tobytes())
+            file.write(packets)
+        os.replace(tmp, path)
@@ -0,0 +1,184 @@
+from asyncio import AbstractEventLoop
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+import struct
+from time import perf_counter, sleep
+
+import numpy
+
+from .decoding import audio_info, decode_chunk, is_compressed
+from .metrics import AudioMetrics
+from .opus_cache import OpusCache
+from .se_cache import SECache
+from .streams import BufferStream, CircularStream, EncodedFrame, FRAME_SIZE, MappedFile, MultiStream
+
+# Frames written and frames read, each only ever increased by one side
+_COUNTERS = struct.Struct('=qq')
+# Payload length and whether the payload is an Opus packet (rather than PCM)
+_SLOT_HEADER = struct.Struct('=II')
+_SLOT_SIZE = _SLOT_HEADER.size + FRAME_SIZE
+
+class RemoteMixer():
+    """Mixes (and if possible, encodes) a session's audio in a separate process.
+
+    The worker writes finished frames into a ring in shared memory, staying at most `slots` frames
+    ahead; reading a frame is just a copy, so the player thread never competes with the event loop
+    for the GIL for long. Sound effects are requested over a pipe, which also reports back when they
+    are done, or failed to load. Only works with a raw PCM BGM.
+    """
+
+    # Mixes in another process, loading sound effects there by path.
+    remote = True
+
+    def __init__(self, bgm: str, loop: AbstractEventLoop, slots: int = 5, se_cache_size: int = 64 * 1024 * 1024,
+                 encode: bool = True) -> None:
+        self.__loop = loop
+        self.__slots = slots
+        self.__memory = SharedMemory(create=True, size=_COUNTERS.size + slots * _SLOT_SIZE)
+        self.__counters = numpy.ndarray(2, numpy.int64, self.__memory.buf)
+        self.__counters[:] = 0
+        self.__metrics = AudioMetrics()
+        self.__callbacks = {}
+        self.__next_token = 0
+        self.__resumed_at = None
+
+        context = get_context('spawn')
+        self.__control, child = context.Pipe()
+        self.__process = context.Process(
+            target=_run, args=(self.__memory.name, slots, bgm, se_cache_size, encode, child), daemon=True
+        )
+        self.__process.start()
+        loop.add_reader(self.__control.fileno(), self.__receive)
+
+    @property
+    def metrics(self) -> AudioMetrics:
+        return self.__metrics
+
+    def add_file(self, path: str, after: callable = None) -> None:
+        """Mix in the sound effect at `path`, then call `after` on the event loop."""
+        token = self.__next_token
+        self.__next_token += 1
+        self.__callbacks[token] = after
+        self.__control.send(('add', path, token))
+
+    def pause(self) -> None:
+        """Have the worker stop mixing until resume(); the frames it mixed ahead stay in the ring."""
+        self.__control.send(('pause',))
+
+    def resume(self, requested_at: float) -> None:
+        self.__control.send(('resume',))
+        self.__resumed_at = requested_at
+
+    def read(self, size=-1):
+        written, read = self.__counters
+        self.__metrics.frames += 1
+        if self.__resumed_at is not None:
+            self.__metrics.resume_latency.record(perf_counter() - self.__resumed_at)
+            self.__resumed_at = None
+        if written == read or size != FRAME_SIZE:
+            # The worker fell behind; better to play silence than to wait.
+            self.__metrics.underruns += 1
+            return bytes(max(size, 0))
+
+        offset = _COUNTERS.size + (read % self.__slots) * _SLOT_SIZE
+        length, encoded = _SLOT_HEADER.unpack_from(self.__memory.buf, offset)
+        start = offset + _SLOT_HEADER.size
+        payload = bytes(self.__memory.buf[start:start + length])
+        self.__counters[1] = read + 1
+        self.__metrics.bytes_read['remote'] += length
+        if encoded:
+            self.__metrics.encoded_frames += 1
+            return EncodedFrame(payload, size)
+        return payload
+
+    def shutdown(self) -> None:
+        self.__loop.remove_reader(self.__control.fileno())
+        try:
+            self.__control.send(('stop',))
+        except OSError:
+            pass
+        self.__process.join(1)
+        del self.__counters
+        self.__memory.close()
+        self.__memory.unlink()
+
+    def __receive(self) -> None:
+        try:
+            message = self.__control.recv()
+        except (EOFError, OSError):
+            self.__loop.remove_reader(self.__control.fileno())
+            return
+        if message[0] in ('finished', 'failed'):
+            if message[0] == 'failed':
+                print('Could not play {}: {}'.format(message[2], message[3]))
+            after = self.__callbacks.pop(message[1], None)
+            if callable(after):
+                after()
+
+def _run(memory_name: str, slots: int, bgm: str, se_cache_size: int, encode: bool, control: Connection) -> None:
+    memory = SharedMemory(memory_name)
+    counters = numpy.ndarray(2, numpy.int64, memory.buf)
+    bgm_file = MappedFile(bgm)
+    bgm_stream = CircularStream(bgm_file.view, FRAME_SIZE)
+    stream = MultiStream().add_stream(bgm_stream, source='bgm')
+    cache = SECache(se_cache_size)
+
+    encoder = None
+    if encode:
+        try:
+            from discord.opus import Encoder
+            encoder = Encoder(48000, 2)
+            # Only use pre-encoded BGM if the main process already built it.
+            packets = OpusCache('{}.opus'.format(bgm))
+            if packets.is_fresh_for(bgm, FRAME_SIZE):
+                bgm_stream.use_packets(packets)
+        except Exception:
+            pass
+
+    paused = False
+    while True:
+        # While paused, block on the pipe instead of polling it.
+        while paused or control.poll():
+            message = control.recv()
+            if message[0] == 'stop':
+                del counters
+                memory.close()
+                return
+            if message[0] in ('pause', 'resume'):
+                paused = message[0] == 'pause'
+                continue
+            _, path, token = message
+            try:
+                source = _load(path, cache)
+            except Exception as e:
+                # Like a file removed since it was indexed. Report it, so nobody waits for it forever.
+                control.send(('failed', token, path, str(e)))
+                continue
+            stream.add_stream(source, lambda token=token: control.send(('finished', token)), 'se')
+
+        written, read = counters
+        if written - read >= slots:
+            sleep(0.005)
+            continue
+
+        frame = stream.read(FRAME_SIZE)
+        if isinstance(frame, EncodedFrame):
+            payload, encoded = frame.packet, True
+        elif encoder is not None:
+            payload, encoded = encoder.encode(bytes(frame), FRAME_SIZE // 4), True
+        else:
+            payload, encoded = frame, False
+
+        offset = _COUNTERS.size + (written % slots) * _SLOT_SIZE
+        _SLOT_HEADER.pack_into(memory.buf, offset, len(payload), encoded)
+        start = offset + _SLOT_HEADER.size
+        memory.buf[start:start + len(payload)] = payload
+        counters[0] = written + 1
+
+def _load(path: str, cache: SECache) -> BufferStream:
+    if not is_compressed(path):
+        return BufferStream(cache.get(path))
+    # Sound effects are short, and this process has time to spare between frames.
+    data, _ = decode_chunk(path, 0, audio_info(path).frames)
+    return BufferStream(data)
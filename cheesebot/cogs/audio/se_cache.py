@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from os import stat
+from threading import Lock
+
+class SECache():
+    """Keeps recently played sound effects in memory, up to a total size in bytes.
+
+    Entries are invalidated when the file's mtime changes; the least recently used
+    entries are evicted once the budget is exceeded.
+    """
+
+    def __init__(self, budget: int) -> None:
+        self.__budget = budget
+        self.__size = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, path: str) -> bytes:
+        mtime = stat(path).st_mtime_ns
+        with self.__lock:
+            entry = self.__entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self.__entries.move_to_end(path)
+                return entry[1]
+
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        with self.__lock:
+            self.__discard(path)
+            if len(data) <= self.__budget:
+                self.__entries[path] = (mtime, data)
+                self.__size += len(data)
+                while self.__size > self.__budget:
+                    self.__discard(next(iter(self.__entries)))
+
+        return data
+
+    def __discard(self, path: str) -> None:
+        entry = self.__entries.pop(path, None)
+        if entry is not None:
+            self.__size -= len(entry[1])
@@ -0,0 +1,124 @@
+from collections import namedtuple
+from os import scandir, stat
+from os.path import join
+from threading import Event, Thread
+
+from .decoding import DECODABLE_SUFFIXES, RAW_SUFFIX, audio_info, is_compressed
+from .streams import BYTES_PER_SECOND
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+SUFFIXES = (RAW_SUFFIX,) + DECODABLE_SUFFIXES
+
+SEInfo = namedtuple('SEInfo', ['size', 'mtime', 'duration'])
+
+def _is_se(name: str) -> bool:
+    return name.lower().endswith(SUFFIXES)
+
+def _info(path: str, st, old: SEInfo = None) -> SEInfo:
+    if old is not None and (old.size, old.mtime) == (st.st_size, st.st_mtime_ns):
+        return old
+    if not is_compressed(path):
+        return SEInfo(st.st_size, st.st_mtime_ns, st.st_size / BYTES_PER_SECOND)
+    try:
+        info = audio_info(path)
+        duration = info.frames / info.rate
+    except Exception:
+        duration = None
+    return SEInfo(st.st_size, st.st_mtime_ns, duration)
+
+class SEIndex(Thread):
+    """Keeps track of the sound effects in a directory, so looking them up never touches the disk.
+
+    Changes are picked up through inotify if inotify_simple is installed, otherwise the directory
+    is rescanned every `interval` seconds.
+    """
+
+    def __init__(self, path: str, interval: float = 30) -> None:
+        super().__init__(daemon=True)
+        self.__path = path
+        self.__interval = interval
+        self.__dying = Event()
+        self.__entries = {}
+        self.__items = ()
+        self.__warned = False
+        self.__scan()
+
+    @property
+    def items(self) -> tuple:
+        return self.__items
+
+    def info(self, path: str) -> SEInfo:
+        return self.__entries.get(path)
+
+    def run(self):
+        if INotify is not None:
+            try:
+                self.__watch()
+                return
+            except OSError as e:
+                # Like when the directory doesn't exist (yet); it is picked up once it does.
+                print('Could not watch {}, rescanning every {} s instead: {}'.format(self.__path, self.__interval, e))
+        self.__poll()
+
+    def shutdown(self, signal: int) -> None:
+        self.__dying.set()
+
+    def __poll(self) -> None:
+        while not self.__dying.wait(self.__interval):
+            self.__scan()
+
+    def __watch(self) -> None:
+        inotify = INotify()
+        try:
+            mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.DELETE_SELF
+            inotify.add_watch(self.__path, mask)
+            # Catch anything that changed between the initial scan and adding the watch.
+            self.__scan()
+            while not self.__dying.is_set():
+                events = inotify.read(timeout=1000)
+                if any(event.mask & (flags.Q_OVERFLOW | flags.DELETE_SELF) for event in events):
+                    self.__scan()
+                    continue
+                entries = dict(self.__entries)
+                for event in events:
+                    if not self.__is_se(event.name):
+                        continue
+                    path = join(self.__path, event.name)
+                    try:
+                        entries[path] = _info(path, stat(path))
+                    except OSError:
+                        entries.pop(path, None)
+                if events:
+                    self.__publish(entries)
+        finally:
+            inotify.close()
+
+    def __scan(self) -> None:
+        entries = {}
+        try:
+            for entry in scandir(self.__path):
+                if self.__is_se(entry.name) and entry.is_file():
+                    entries[entry.path] = _info(entry.path, entry.stat(), self.__entries.get(entry.path))
+        except FileNotFoundError:
+            pass
+        if entries != self.__entries:
+            self.__publish(entries)
+
+    def __is_se(self, name: str) -> bool:
+        if _is_se(name):
+            return True
+        if is_compressed(name) and not self.__warned:
+            self.__warned = True
+            print('Skipping sound effects like {} in {}: decoding them needs the soundfile package.'.format(
+                name, self.__path
+            ))
+        return False
+
+    def __publish(self, entries: dict) -> None:
+        # Swap in new objects rather than mutating, so readers in other threads never see a partial update.
+        self.__entries = entries
+        self.__items = tuple(sorted(entries))
@@ -1,42 +1,97 @@
+from asyncio import AbstractEventLoop, CancelledError, Future, ensure_future, shield, sleep
+from concurrent.futures import Executor
 from random import randint
-from threading import Thread, Event, Timer
+from time import perf_counter
+from typing import Union
 
 from . import SEPicker
-from .streams import MultiStream
+from .decoding import DecodedStream, is_compressed
+from .se_cache import SECache
+from .streams import BufferStream, MultiStream
 
-class SEPlayer(Thread):
-    def __init__(self, stream: MultiStream, picker: SEPicker):
-        super().__init__()
+def _resolve(future: Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+class SEPlayer():
+    """Plays a random sound effect every 10 to 60 seconds.
+
+    Runs as a task on the bot's event loop, so any number of players share the same thread.
+    """
+
+    def __init__(self, stream: Union[MultiStream, 'RemoteMixer'], picker: SEPicker, cache: SECache,
+                 loop: AbstractEventLoop, pool: Executor):
         self.__stream = stream
-        self.__resume = Event()
-        self.__dying = Event()
         self.__picker = picker
+        self.__cache = cache
+        self.__loop = loop
+        self.__pool = pool
+        self.__task = None
+        # Resolved once the last sound effect handed to the stream is done
+        self.__playing = None
+
+    def start(self) -> None:
+        self.__task = ensure_future(self.__run(), loop=self.__loop)
+
+    def pause(self) -> None:
+        """Stop scheduling sound effects.
+
+        One that is already playing stays with the mixer, and the next one only starts after it.
+        """
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
 
-    def run(self):
-        while not self.__dying.is_set():
-            self.__do_run()
+    def resume(self) -> None:
+        if self.__task is None:
+            self.start()
 
     def shutdown(self, signal: int) -> None:
-        self.__dying.set()
-        self.__resume.set()
+        if self.__task is not None:
+            self.__loop.call_soon_threadsafe(self.__task.cancel)
 
-    def __do_run(self):
-        Timer(randint(10, 60), self.__resume.set).start()
-        if not self.__wait():
-            return
+    async def __run(self):
+        while True:
+            try:
+                await self.__play_next()
+            except CancelledError:
+                return
+            except Exception as e:
+                # Like a file removed since it was indexed; the next one may well play.
+                print('Could not play a sound effect: {}'.format(e))
+
+    async def __play_next(self):
+        if self.__playing is not None and not self.__playing.done():
+            # One from before a pause is still playing; don't overlap it.
+            await shield(self.__playing)
+        await sleep(randint(10, 60))
 
         se = self.__picker.pick()
+        requested_at = perf_counter()
 
         # If no sound effects found, try again next time.
         if se is None:
             return
 
-        with open(se, 'rb') as stream:
-            self.__stream.add_stream(stream, self.__resume.set)
-            if not self.__wait():
-                return
+        finished = self.__loop.create_future()
+        if self.__stream.remote:
+            # The mixing process loads the sound effect itself.
+            self.__stream.add_file(se, lambda: _resolve(finished))
+            self.__playing = finished
+            await shield(finished)
+            return
+
+        if is_compressed(se):
+            source = DecodedStream(se, self.__pool, self.__loop)
+            await source.ready()
+        else:
+            # Load the sound effect in the executor, so neither the loop nor the audio thread waits for the disk.
+            source = BufferStream(await self.__loop.run_in_executor(None, self.__cache.get, se))
 
-    def __wait(self):
-        self.__resume.wait()
-        self.__resume.clear()
-        return not self.__dying.is_set()
+        # The stream calls back from the audio thread once the sound effect is done.
+        self.__stream.add_stream(
+            source, lambda: self.__loop.call_soon_threadsafe(_resolve, finished), 'se', requested_at
+        )
+        self.__playing = finished
+        # Shielded, so pausing doesn't lose track of when the sound effect is done.
+        await shield(finished)
@@ -0,0 +1,201 @@
+from asyncio import AbstractEventLoop
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Optional, Union
+
+from discord import Channel, VoiceClient
+from discord.voice_client import StreamPlayer
+
+from . import SEPicker
+from .decoding import DecodedStream, is_compressed
+from .metrics import AudioMetrics
+from .se_cache import SECache
+from .opus_cache import OpusCache
+from .se_player import SEPlayer
+from .streams import CircularStream, EncodedFrame, FRAME_SIZE, MappedFile, MultiStream
+
+class VoiceSession():
+    """BGM and sound effects playing in a single voice channel.
+
+    The audio data is shared with all other sessions; a session only owns its position in the BGM
+    and its mixer.
+    """
+
+    def __init__(self, channel: Channel, voice_client: VoiceClient, bgm, se_player: SEPlayer,
+                 stream: Union[MultiStream, 'RemoteMixer']) -> None:
+        self.__channel = channel
+        self.__voice_client = voice_client
+        self.__bgm = bgm
+        self.__stream = stream
+        self.__se_player = se_player
+        self.__player = voice_client.create_stream_player(stream)  # type: discord.voice_client.StreamPlayer
+        assert isinstance(self.__player, StreamPlayer)
+        self.__player.player = self.__play
+        self.__paused = False
+
+    @property
+    def bgm(self):
+        return self.__bgm
+
+    @property
+    def channel(self) -> Channel:
+        return self.__channel
+
+    @property
+    def metrics(self) -> AudioMetrics:
+        return self.__stream.metrics
+
+    @property
+    def paused(self) -> bool:
+        return self.__paused
+
+    def start(self) -> None:
+        self.__player.start()
+        self.__se_player.start()
+
+    def pause(self) -> None:
+        """Stop reading, mixing, encoding and scheduling sound effects until resume().
+
+        The player thread waits on an event, so a paused session costs no CPU, and the BGM simply
+        continues from where it was when resumed.
+        """
+        if self.__paused:
+            return
+        self.__paused = True
+        self.__player.pause()
+        self.__se_player.pause()
+        if self.__stream.remote:
+            self.__stream.pause()
+        self.metrics.paused = True
+
+    def resume(self) -> None:
+        if not self.__paused:
+            return
+        self.__paused = False
+        self.metrics.paused = False
+        self.__stream.resume(perf_counter())
+        self.__se_player.resume()
+        self.__player.resume()
+
+    def shutdown(self, signal: int) -> None:
+        self.__se_player.shutdown(signal)
+        self.__player.stop()
+        # Wait for the player thread to be done with the current frame, which may point into the BGM map.
+        self.__player.join(1)
+        if self.__bgm is not None:
+            self.__bgm.close()
+        if self.__stream.remote:
+            self.__stream.shutdown()
+
+    def __play(self, data) -> None:
+        if isinstance(data, EncodedFrame):
+            self.__voice_client.play_audio(bytes(data.packet), encode=False)
+        else:
+            self.__voice_client.play_audio(data)
+
+class SessionManager():
+    """Runs voice sessions in any number of channels, all reading from the same BGM map and SE cache.
+
+    Compressed audio is decoded by a pool of `decode_workers` processes. A compressed BGM can't be
+    shared or pre-encoded, so every session decodes its own.
+
+    With `remote_mixing`, every session with a raw BGM mixes and encodes in its own process.
+    """
+
+    def __init__(self, bgm: str, se_picker: SEPicker, se_cache: SECache, loop: AbstractEventLoop,
+                 decode_workers: int = 2, remote_mixing: bool = False) -> None:
+        self.__bgm_path = bgm
+        self.__remote_mixer = None
+        if remote_mixing:
+            # Only imported when used, as it needs multiprocessing.shared_memory (Python 3.8 or later).
+            try:
+                from .remote import RemoteMixer
+            except ImportError as e:
+                raise ValueError('The remote_mixing config option needs Python 3.8 or later: {}'.format(e))
+            self.__remote_mixer = RemoteMixer
+        self.__pool = ProcessPoolExecutor(decode_workers)
+        self.__bgm = None
+        self.__packets = None
+        self.__se_picker = se_picker
+        self.__se_cache = se_cache
+        self.__loop = loop
+        self.__sessions = {}
+
+    @property
+    def sessions(self) -> list:
+        return list(self.__sessions.values())
+
+    def get(self, channel: Channel) -> Optional[VoiceSession]:
+        return self.__sessions.get(channel.id)
+
+    def start(self, channel: Channel, voice_client: VoiceClient) -> VoiceSession:
+        if channel.id in self.__sessions:
+            return self.__sessions[channel.id]
+        if is_compressed(self.__bgm_path):
+            bgm = DecodedStream(self.__bgm_path, self.__pool, self.__loop, looping=True)
+        elif self.__remote_mixer is not None:
+            bgm = None
+            if self.__bgm is None:
+                # The mixing processes use the pre-encoded BGM, so get that built.
+                self.__bgm = MappedFile(self.__bgm_path)
+                self.__loop.create_task(self.__load_packets())
+        else:
+            if self.__bgm is None:
+                self.__bgm = MappedFile(self.__bgm_path)
+                self.__loop.create_task(self.__load_packets())
+            bgm = CircularStream(self.__bgm.view, FRAME_SIZE)
+            if self.__packets is not None:
+                bgm.use_packets(self.__packets)
+
+        if bgm is None:
+            stream = self.__remote_mixer(self.__bgm_path, self.__loop)
+        else:
+            stream = MultiStream().add_stream(bgm, source='bgm')
+        se_player = SEPlayer(stream, self.__se_picker, self.__se_cache, self.__loop, self.__pool)
+        session = VoiceSession(channel, voice_client, bgm, se_player, stream)
+        self.__sessions[channel.id] = session
+        session.start()
+        self.update_presence(channel)
+        return session
+
+    def update_presence(self, channel: Channel) -> None:
+        """Pause the session in `channel` if nobody is there to listen, or resume it if somebody is."""
+        session = self.get(channel)
+        if session is None:
+            return
+        listening = any(not member.bot for member in channel.voice_members)
+        if listening and session.paused:
+            session.resume()
+            print('Resumed audio in {} on {}'.format(channel.name, channel.server.name))
+        elif not listening and not session.paused:
+            session.pause()
+            print('Nobody is listening in {} on {}, pausing audio'.format(channel.name, channel.server.name))
+
+    async def __load_packets(self) -> None:
+        # Until the BGM is encoded, sessions just encode live.
+        try:
+            self.__packets = await self.__loop.run_in_executor(
+                None, OpusCache.load_or_build, self.__bgm_path, self.__bgm.view, FRAME_SIZE
+            )
+        except Exception as e:
+            print('Could not pre-encode BGM, encoding live instead: {}'.format(e))
+            return
+        for session in self.__sessions.values():
+            if isinstance(session.bgm, CircularStream):
+                session.bgm.use_packets(self.__packets)
+
+    def shutdown(self, signal: int) -> None:
+        for session in self.__sessions.values():
+            session.shutdown(signal)
+        self.__sessions.clear()
+        self.__pool.shutdown(wait=False)
+        # With the last session gone, so is the last reader of the BGM map and its packets.
+        try:
+            if self.__packets is not None:
+                self.__packets.close()
+            if self.__bgm is not None:
+                self.__bgm.close()
+        except BufferError:
+            # Still being pre-encoded; the maps go with the process.
+            pass
+        self.__bgm = self.__packets = None
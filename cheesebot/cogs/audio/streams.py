@@ -1,36 +1,225 @@
-from audioop import mul, add
-from io import BufferedReader
+from mmap import mmap, ACCESS_READ
+from time import perf_counter
+
+import numpy
+
+from .metrics import AudioMetrics
+
+# 48 kHz, 16 bit, stereo
+BYTES_PER_SECOND = 48000 * 2 * 2
+# 20 ms, which is what discord.py reads (and encodes) at a time
+FRAME_SIZE = BYTES_PER_SECOND // 50
+# The gain of a stream mixed alone or with one other; with more, each gets 1 / count.
+MAX_GAIN = 0.5
+
+class MappedFile():
+    """Read-only memory map of a file, which any number of streams can read from."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self.__map = mmap(file.fileno(), 0, access=ACCESS_READ)
+        self.__view = memoryview(self.__map)
+
+    @property
+    def view(self) -> memoryview:
+        return self.__view
+
+    def close(self) -> None:
+        self.__view.release()
+        self.__map.close()
+
+class EncodedFrame():
+    """An already Opus encoded frame, standing in for `size` bytes of PCM."""
+
+    def __init__(self, packet, size: int) -> None:
+        self.packet = packet
+        self.__size = size
+
+    def __len__(self):
+        return self.__size
+
+class CircularStream():
+    """Endlessly loops over a buffer, keeping nothing but its own position.
+
+    Reads return memoryview slices of the buffer. Only a frame crossing the loop point is copied.
+    If `frame_size` is given, the loop is padded with silence to a whole number of frames, so
+    every lap starts on a frame boundary and pre-encoded frames can be used.
+    """
+
+    def __init__(self, buffer, frame_size: int = None) -> None:
+        self.__view = memoryview(buffer)
+        self.__length = len(self.__view)
+        if frame_size is not None:
+            self.__length = -(-self.__length // frame_size) * frame_size
+        self.__frame_size = frame_size
+        self.__position = 0
+        self.__packets = None
+
+    def use_packets(self, packets: 'OpusCache') -> None:
+        """Serve frames from `packets` (encoded from this loop with our frame size) when possible."""
+        assert packets.frame_size == self.__frame_size and len(packets) * self.__frame_size == self.__length
+        self.__packets = packets
+
+    def close(self) -> None:
+        """Let go of the buffer, so that a map it reads from can be closed."""
+        self.__view.release()
+
+    def read_encoded(self, size: int):
+        """Return the current frame as an Opus packet and advance past it, or None if not available."""
+        packets = self.__packets
+        if packets is None or size != self.__frame_size or self.__position % size:
+            return None
+        packet = packets[self.__position // size]
+        self.__position = (self.__position + size) % self.__length
+        return packet
 
-class CircularStream(BufferedReader):
     def read(self, size=-1):
-        data = super().read(size)
-        while len(data) < size:
-            self.seek(0)
-            data += super().read(size - len(data))
-        return data
+        start = self.__position
+        if size < 0:
+            size = self.__length - start
+        end = start + size
+        if end <= len(self.__view):
+            self.__position = end % self.__length
+            return self.__view[start:end]
+
+        # Stitch together the end, padding and (repeated) start of the loop.
+        parts = []
+        remaining = size
+        position = start
+        while remaining > 0:
+            take = min(remaining, self.__length - position)
+            part = self.__view[position:position + take]
+            parts.append(part)
+            if len(part) < take:
+                parts.append(bytes(take - len(part)))
+            position = (position + take) % self.__length
+            remaining -= take
+        self.__position = position
+        return b''.join(parts)
+
+class BufferStream():
+    """Reads from an in-memory buffer, returning memoryview slices instead of copies."""
+
+    def __init__(self, buffer) -> None:
+        self.__view = memoryview(buffer)
+        self.__position = 0
+
+    def read(self, size=-1):
+        start = self.__position
+        end = len(self.__view) if size < 0 else min(start + size, len(self.__view))
+        self.__position = end
+        return self.__view[start:end]
+
+class Mixer():
+    """Mixes 16 bit PCM samples into reusable per-frame-size buffers."""
+
+    def __init__(self) -> None:
+        self.__buffers = {}
+
+    def mix(self, samples: list, size: int) -> bytes:
+        """Mix (sample, gain) pairs into one frame of `size` bytes.
+
+        Samples shorter than `size` are treated as if padded with silence.
+        Scaling rounds towards minus infinity, like audioop.mul does, and the sum is clipped after
+        every sample, like audioop.add does, so the output is the same as mixing with audioop.
+        """
+        count = size // 2
+        if count not in self.__buffers:
+            self.__buffers[count] = (
+                numpy.empty(count, numpy.int32), numpy.empty(count, numpy.int32), numpy.empty(count, numpy.float64)
+            )
+        acc, halved, scaled = self.__buffers[count]
+        acc.fill(0)
+
+        for sample, gain in samples:
+            length = min(len(sample) // 2, count)
+            if not length:
+                continue
+            pcm = numpy.frombuffer(sample, numpy.int16, length)
+            if gain == 0.5:
+                # Exact shortcut for the common case of at most two streams.
+                part = halved[:length]
+                numpy.right_shift(pcm, 1, out=part)
+            else:
+                part = scaled[:length]
+                numpy.multiply(pcm, gain, out=part)
+                numpy.floor(part, out=part)
+            mixed = acc[:length]
+            numpy.add(mixed, part, out=mixed, casting='unsafe')
+            numpy.clip(mixed, -32768, 32767, out=mixed)
+
+        return acc.astype(numpy.int16).tobytes()
 
 class MultiStream():
-    def __init__(self):
+    # Mixes in this process, from streams it is handed (unlike RemoteMixer).
+    remote = False
+
+    def __init__(self, metrics: AudioMetrics = None):
         self.__streams = []
+        self.__mixer = Mixer()
+        self.__metrics = metrics or AudioMetrics()
+        self.__last_read = None
+        self.__resumed_at = None
+
+    @property
+    def metrics(self) -> AudioMetrics:
+        return self.__metrics
 
-    def add_stream(self, stream, after: callable = None):
-        self.__streams.append((stream, after))
+    def add_stream(self, stream, after: callable = None, source: str = 'other', requested_at: float = None):
+        """Mix `stream` in until it ends, then call `after`.
+
+        `source` groups the bytes read in the metrics. If `requested_at` (a perf_counter() value) is
+        given, the time until the stream's first frame is recorded as its start latency.
+        """
+        self.__streams.append([stream, after, source, requested_at])
         return self
 
+    def resume(self, requested_at: float) -> None:
+        """Tell the stream that the player was paused on purpose, and time its first frame since then."""
+        self.__last_read = None
+        self.__resumed_at = requested_at
+
     def read(self, size=-1):
-        data = b'\x00' * size
-        for item in self.__streams:
-            stream, after = item
+        metrics = self.__metrics
+        start = perf_counter()
+        # The player asks for a frame every frame duration; a longer gap means the listeners heard a gap.
+        if self.__last_read is not None and start - self.__last_read > 1.5 * size / BYTES_PER_SECOND:
+            metrics.underruns += 1
+        self.__last_read = start
+        if self.__resumed_at is not None:
+            metrics.resume_latency.record(start - self.__resumed_at)
+            self.__resumed_at = None
+
+        # With nothing to mix, a pre-encoded frame spares the player from encoding one.
+        if len(self.__streams) == 1 and hasattr(self.__streams[0][0], 'read_encoded'):
+            packet = self.__streams[0][0].read_encoded(size)
+            if packet is not None:
+                metrics.encoded_frames += 1
+                metrics.frames += 1
+                # The PCM this frame stands for, so the BGM counts as read either way.
+                metrics.bytes_read[self.__streams[0][2]] += size
+                return EncodedFrame(packet, size)
+
+        samples = []
+        for item in list(self.__streams):
+            stream, after, source, requested_at = item
             sample = stream.read(size)
+            metrics.bytes_read[source] += len(sample)
+            if requested_at is not None:
+                metrics.se_latency.record(start - requested_at)
+                item[3] = None
 
-            # Close streams that have ended.
+            # Close streams that have ended. Their gain is determined after removal,
+            # so a stream that has just ended is still mixed at the louder level.
             if len(sample) < size:
-                sample += b'\x00' * (size - len(sample))
                 self.__streams.remove(item)
                 if callable(after):
                     after()
 
-            sample = mul(sample, 2, min(0.5, 1 / len(self.__streams)))
-            data = add(data, sample, 2)
+            samples.append((sample, min(MAX_GAIN, 1 / max(1, len(self.__streams)))))
 
+        data = self.__mixer.mix(samples, size)
+        metrics.frames += 1
+        metrics.active_streams = len(self.__streams)
+        metrics.mix_time.record(perf_counter() - start)
         return data
@@ -1,7 +1,4 @@
-from tinydb import Query
-from tinydb.database import Table
-
-from .. import Picker
+from .. import Picker, PhraseIndex
 
 class CheeseCog():
     def __init__(self, bot: 'cheesebot.CheeseBot') -> None:
@@ -14,22 +11,46 @@ class CheeseCog():
     def shutdown(self, signal: int):
         pass
 
-Phrase = Query()
-
 class PhrasePicker(Picker):
-    def __init__(self, table: Table, phrase_set: str) -> None:
-        self.__table = table
+    def __init__(self, index: PhraseIndex, phrase_set: str) -> None:
+        self.__index = index
         self.__set = phrase_set
         super().__init__()
 
     def _all_items(self):
-        return map(lambda row: row['content'], self.__table.search(Phrase.set == self.__set))
+        return self.__index.phrases(self.__set)
+
+class PhraseSetPicker(Picker):
+    def __init__(self, index: PhraseIndex, phrase_sets: list) -> None:
+        self.__index = index
+        self.__sets = phrase_sets
+        self.__phrases = None
+        self.__nonempty = ()
+        super().__init__()
+
+    def _all_items(self):
+        # The index hands out a new tuple when a set changes, so only then can the non-empty sets change.
+        phrases = [self.__index.phrases(phrase_set) for phrase_set in self.__sets]
+        if self.__phrases is None or any(a is not b for a, b in zip(phrases, self.__phrases)):
+            self.__phrases = phrases
+            nonempty = tuple(phrase_set for phrase_set, items in zip(self.__sets, phrases) if items)
+            if nonempty != self.__nonempty:
+                self.__nonempty = nonempty
+        return self.__nonempty
 
 class MentionCog(CheeseCog):
-    def __init__(self, bot: 'cheesebot.CheeseBot', phrase_picker: PhrasePicker):
+    def __init__(self, bot: 'cheesebot.CheeseBot', set_picker: PhraseSetPicker, phrase_pickers: dict):
         super().__init__(bot)
-        self.__phrase_picker = phrase_picker
+        self.__set_picker = set_picker
+        self.__phrase_pickers = phrase_pickers
 
     async def on_message(self, message):
         if message.content.find(self.bot.user.mention) >= 0:
-            await self.bot.send_message(message.channel, self.__phrase_picker.pick())
+            # During a flood, most replies are dropped; don't use up phrases on those.
+            if self.bot.outbox.coalesced(message.channel, 'mention') is not None:
+                return
+            phrase_set = self.__set_picker.pick()
+            if phrase_set is not None:
+                await self.bot.send_message(
+                    message.channel, self.__phrase_pickers[phrase_set].pick(), coalesce='mention'
+                )
@@ -1,32 +1,46 @@
-from . import CheeseCog, MentionCog, AudioCog, AdminCog
+from os.path import exists
+from typing import Union
+
+from . import CheeseCog, MentionCog, AdminCog
 
 class CogFactory():
     def __init__(self, bot: 'cheesebot.CheeseBot') -> None:
         self.__bot = bot
         self.__factories = {
-            AudioCog: self.__create_audio_cog,
-            MentionCog: self.__create_mention_cog,
-            AdminCog: self.__create_admin_cog,
+            'AudioCog': self.__create_audio_cog,
+            MentionCog.__name__: self.__create_mention_cog,
+            AdminCog.__name__: self.__create_admin_cog,
         }
 
-    def __call__(self, cog_type: type) -> CheeseCog:
-        return self.__factories[cog_type]()
+    def __call__(self, cog_type: Union[type, str]) -> CheeseCog:
+        """Create a cog of the given type, or the type with the given name (so it needn't be imported yet)."""
+        return self.__factories[getattr(cog_type, '__name__', cog_type)]()
 
-    def __create_audio_cog(self) -> AudioCog:
-        from .audio import SEPicker
+    def __create_audio_cog(self) -> 'AudioCog':
+        from .audio import AudioCog, SEPicker
+        from .audio.decoding import DECODABLE_SUFFIXES, RAW_SUFFIX
+        from .audio.se_cache import SECache
+        bgm_candidates = ['{}/bgm/stream{}'.format(self.__bot.data_path, suffix)
+                          for suffix in (RAW_SUFFIX,) + DECODABLE_SUFFIXES]
         return AudioCog(
             self.__bot,
             voice_channel=self.__bot.config['voice_channel'],
-            bgm='{}/bgm/stream.raw'.format(self.__bot.data_path),
-            se_picker=SEPicker('{}/se'.format(self.__bot.data_path))
+            bgm=next(filter(exists, bgm_candidates), bgm_candidates[0]),
+            se_picker=SEPicker('{}/se'.format(self.__bot.data_path)),
+            se_cache=SECache(self.__bot.config.get('se_cache_size', 64 * 1024 * 1024)),
+            decode_workers=self.__bot.config.get('decode_workers', 2),
+            remote_mixing=self.__bot.config.get('remote_mixing', False)
         )
 
     def __create_mention_cog(self) -> MentionCog:
-        from .cogs import PhrasePicker
-        return MentionCog(self.__bot, PhrasePicker(
-            self.__bot.db.table('phrases'),
-            self.__bot.config['phrase_sets'][0] # TODO: one phrase picker per set
-        ))
+        from .cogs import PhrasePicker, PhraseSetPicker
+        index = self.__bot.phrases
+        phrase_sets = self.__bot.config['phrase_sets']
+        return MentionCog(
+            self.__bot,
+            PhraseSetPicker(index, phrase_sets),
+            {phrase_set: PhrasePicker(index, phrase_set) for phrase_set in phrase_sets}
+        )
 
     def __create_admin_cog(self) -> AdminCog:
         return AdminCog(self.__bot)
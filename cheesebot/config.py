@@ -1,6 +1,8 @@
-from asyncio import coroutine, get_event_loop, ensure_future
 from collections import defaultdict
-from typing import Union
+from collections.abc import Mapping
+from threading import Lock
+from types import MappingProxyType
+from typing import Iterator, Union
 
 from tinydb import Query
 from tinydb.database import Table
@@ -22,33 +24,133 @@ def _handles(key: str) -> callable:
         return func
     return decorator
 
-def _await(coro: coroutine) -> None:
-    get_event_loop().call_soon_threadsafe(ensure_future, coro)
+_unset = object()
+# Seconds without further changes before handlers run, so a burst of changes is handled once.
+_DISPATCH_DELAY = 1.0
+
+class _Levels():
+    """Config entries of all levels, loaded once and shared by the views on every level."""
+
+    def __init__(self, table: Table) -> None:
+        self.table = table
+        self.views = {}
+        self.reload()
+
+    def reload(self) -> None:
+        entries = {}
+        for entry in self.table.all():
+            entry = dict(entry)
+            entries.setdefault(entry.pop('level_min'), {}).update(entry)
+        self.entries = entries
+        self.sorted_levels = sorted(entries)
+
+    def effective(self, level: int) -> dict:
+        config = {}
+        for level_min in self.sorted_levels:
+            if level_min > level:
+                break
+            config.update(self.entries[level_min])
+        return config
+
+    def lookup(self, key: str, level: int) -> ConfigEntry:
+        for level_min in reversed(self.sorted_levels):
+            if level_min <= level and key in self.entries[level_min]:
+                return self.entries[level_min][key]
+        return _unset
+
+    def set(self, key: str, value: ConfigEntry, level: int) -> None:
+        if level not in self.entries:
+            self.entries[level] = {}
+            self.sorted_levels = sorted(self.entries)
+        self.entries[level][key] = value
 
 @_has_handlers
-class Config(dict):
+class Config(Mapping):
+    """Effective config at a level, read from an immutable snapshot that changes are swapped in as.
+
+    Readers never see a half-applied change and need no lock; anyone needing several consistent
+    values can hold on to `snapshot`. Handlers of changed keys run on the event loop, once per key
+    after changes have settled, and only if the value differs from what they handled last.
+    """
+
     _handlers = defaultdict(list)
 
-    def __init__(self, bot: 'CheeseBot', level: int=0) -> None:
-        super().__init__()
+    def __init__(self, bot: 'CheeseBot', level: int=0, levels: _Levels=None) -> None:
         self.__bot = bot
-        self.__table = bot.db.table('config')
-        self._handlers = {k: [m.__get__(self) for m in v] for k, v in self._handlers.items()}
+        self.__snapshot = (0, MappingProxyType({}))
+        self.__pending = {}
+        self.__pending_lock = Lock()
+        self.__dispatch_handle = None
+        if levels is None:
+            levels = _Levels(bot.db.table('config'))
+            self._handlers = {k: [m.__get__(self) for m in v] for k, v in self._handlers.items()}
+        else:
+            # Only the bot's own config reacts to changes; views on other levels are for inspection.
+            self._handlers = {}
+        self.__levels = levels
+        self.__table = levels.table
+        self.__level = None
         self.level = level
+        self.__handled = dict(self.snapshot)
+
+    @property
+    def snapshot(self) -> Mapping:
+        return self.__snapshot[1]
+
+    @property
+    def version(self) -> int:
+        """Increases with every change, so readers can tell whether their snapshot is outdated."""
+        return self.__snapshot[0]
 
     def at_level(self, level: int) -> 'Config':
-        if level == self.level:
-            return self
-        return Config(self.__table, level)
+        view = self.__levels.views.get(level)
+        if view is None:
+            view = Config(self.__bot, level, self.__levels)
+        return view
+
+    def reload(self) -> None:
+        """Pick up changes made to the config table behind our back."""
+        self.__levels.reload()
+        for view in list(self.__levels.views.values()):
+            view.level = view.level
 
     def __getitem__(self, key: str) -> ConfigEntry:
-        return super().__getitem__(key)
+        return self.__snapshot[1][key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__snapshot[1])
+
+    def __len__(self) -> int:
+        return len(self.__snapshot[1])
+
+    def get(self, key: str, default=None) -> ConfigEntry:
+        return self.__snapshot[1].get(key, default)
 
     def __setitem__(self, key: str, value: ConfigEntry) -> None:
-        super().__setitem__(key, value)
         doc = {key: value, 'level_min': self.level}
         self.__table.upsert(doc, ConfigQuery.level_min == self.level)
-        self.__handle(key, value)
+        self.__levels.set(key, value, self.level)
+
+        # Only views at or above this level can see the change, and only this key changed.
+        for view in list(self.__levels.views.values()):
+            if view.level >= self.level:
+                view.__refresh(key)
+
+    def __refresh(self, key: str) -> None:
+        value = self.__levels.lookup(key, self.level)
+        config = self.snapshot
+        if value is _unset:
+            if key in config:
+                self.__swap({k: v for k, v in config.items() if k != key})
+        elif config.get(key, _unset) != value:
+            config = dict(config)
+            config[key] = value
+            self.__swap(config)
+            self.__handle(key, value)
+
+    def __swap(self, config: dict) -> None:
+        # A single assignment, so readers see either the old or the new version as a whole.
+        self.__snapshot = (self.__snapshot[0] + 1, MappingProxyType(config))
 
     @property
     def level(self) -> int:
@@ -56,23 +158,14 @@ class Config(dict):
 
     @level.setter
     def level(self, value: int) -> None:
+        views = self.__levels.views
+        if views.get(self.__level) is self:
+            del views[self.__level]
+        views[value] = self
         self.__level = value
 
-        entries = self.__table.search(ConfigQuery.level_min <= value)
-
-        # Collect config in new dict to avoid reaching an inconsistent state
-        old_config = self.copy()
-        new_config = {}
-        for entry in sorted(entries, key=lambda entry: entry['level_min']):
-            new_config.update(entry)
-        del new_config['level_min']
-
-        # Update as atomically as possible (doing a clear(); update() would mean we're losing
-        # all configuration for a split second. Not good for a threaded application.)
-        keys_to_delete = set(self.keys()).difference(new_config.keys())
-        self.update(new_config)
-        for key in keys_to_delete:
-            del self[key]
+        old_config = self.snapshot
+        self.__swap(self.__levels.effective(value))
 
         # Call all handlers for now-current values
         for key in old_config.keys():
@@ -80,13 +173,34 @@ class Config(dict):
             if old_config[key] != new_value:
                 self.__handle(key, new_value)
 
-    def __handle(self, key: str, value: ConfigEntry):
-        for meth in self._handlers.get(key, []):
-            meth(value)
+    def __handle(self, key: str, value: ConfigEntry) -> None:
+        if key not in self._handlers:
+            return
+        with self.__pending_lock:
+            self.__pending[key] = value
+        self.__bot.loop.call_soon_threadsafe(self.__schedule_dispatch)
+
+    def __schedule_dispatch(self) -> None:
+        # Every change pushes the dispatch back, so a burst of changes ends in a single one.
+        if self.__dispatch_handle is not None:
+            self.__dispatch_handle.cancel()
+        self.__dispatch_handle = self.__bot.loop.call_later(_DISPATCH_DELAY, self.__dispatch)
+
+    def __dispatch(self) -> None:
+        self.__dispatch_handle = None
+        with self.__pending_lock:
+            pending, self.__pending = self.__pending, {}
+        for key, value in pending.items():
+            # Changed back and forth in the meantime.
+            if self.__handled.get(key, _unset) == value:
+                continue
+            self.__handled[key] = value
+            for meth in self._handlers[key]:
+                meth(value)
 
     @_handles('bot_name')
     def __update_bot_name(self, new_name: str) -> None:
         for server in self.__bot.servers:
             member = server.get_member(self.__bot.user.id)
             break
-        _await(self.__bot.change_nickname(member, new_name))
+        self.__bot.loop.create_task(self.__bot.change_nickname(member, new_name))
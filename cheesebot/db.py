@@ -1,46 +1,448 @@
+from collections import defaultdict
+from contextlib import contextmanager
 from functools import wraps
-from threading import Lock, Timer
-from typing import Union
+import json
+import os
+from threading import Condition, Event, Lock, Thread, Timer, local
+from time import sleep
+from itertools import dropwhile, islice
+from typing import Iterator, Optional, Union
 
 from tinydb import TinyDB
+from tinydb.database import Document, StorageProxy, Table
 from tinydb.middlewares import Middleware
 from tinydb.storages import Storage
+from tinydb.utils import freeze
+
+class ReadWriteLock():
+    """Lets any number of readers in at once, or a single writer. Waiting writers go first."""
+
+    def __init__(self) -> None:
+        self.__condition = Condition(Lock())
+        self.__readers = 0
+        self.__writing = False
+        self.__waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        with self.__condition:
+            while self.__writing or self.__waiting_writers:
+                self.__condition.wait()
+            self.__readers += 1
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__readers -= 1
+                if not self.__readers:
+                    self.__condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self.__condition:
+            self.__waiting_writers += 1
+            while self.__writing or self.__readers:
+                self.__condition.wait()
+            self.__waiting_writers -= 1
+            self.__writing = True
+        try:
+            yield
+        finally:
+            with self.__condition:
+                self.__writing = False
+                self.__condition.notify_all()
+
+class StaleWriteError(RuntimeError):
+    """A write based on data that another thread has changed since; nothing was written."""
 
 class LockingCachingMiddleware(Middleware):
-    def __init__(self, storage_cls: Union[Middleware, Storage]=TinyDB.DEFAULT_STORAGE) -> None:
+    def __init__(self, storage_cls: Union[Middleware, Storage]=TinyDB.DEFAULT_STORAGE, flush_delay: float=300) -> None:
         super().__init__(storage_cls)
-        self.__lock = Lock()
-        self.__cache = None
+        self.__lock = ReadWriteLock()
+        # The cached data and how many writes it has seen, swapped together so readers get a matching pair
+        self.__state = (None, 0)
+        self.__seen = local()
+        self.__flush_delay = flush_delay
         self.__flush_timer = None
+        self.__flush_lock = Lock()
 
     def read(self) -> dict:
-        with self.__lock:
-            if self.__cache is None:
-                self.__cache = self.storage.read()
-            return self.__cache
+        cache, generation = self.__state
+        if cache is None:
+            with self.__lock.writing():
+                if self.__state[0] is None:
+                    self.__state = (self.storage.read(), self.__state[1])
+                cache, generation = self.__state
+        # Remember which version this thread is working on, so write() can tell if it's outdated.
+        self.__seen.generation = generation
+        # TinyDB changes what it read in place before writing it back, so it gets its own dict of
+        # tables. The tables themselves are replaced rather than changed, so they can be shared.
+        return None if cache is None else dict(cache)
 
     def write(self, data: dict) -> None:
-        old_data = self.__cache.copy()
-        with self.__lock:
-            # Poor man's deadlock detection
-            assert old_data == self.__cache, 'Locking error, please retry.'
-            self.__cache = data
+        with self.__lock.writing():
+            generation = self.__state[1]
+            if getattr(self.__seen, 'generation', generation) != generation:
+                # Someone else wrote since this thread last read, so their changes would get lost.
+                raise StaleWriteError('Locking error, please retry.')
+            self.__state = (data, generation + 1)
+            self.__seen.generation = generation + 1
             if not self.__flush_timer:
-                self.__flush_timer = Timer(300, self.__flush)
+                self.__flush_timer = Timer(self.__flush_delay, self.__flush)
                 self.__flush_timer.start()
 
     def close(self) -> None:
         if self.__flush_timer:
             self.__flush_timer.cancel()
         self.__flush()
-        with self.__lock:
+        with self.__lock.writing():
             self.storage.close()
 
     def __flush(self) -> None:
+        # TinyDB replaces whole tables instead of changing them in place, so a shallow copy is a
+        # consistent snapshot. Serializing it doesn't need to hold anyone up.
+        with self.__flush_lock:
+            with self.__lock.reading():
+                cache = self.__state[0]
+                if cache is None:
+                    return
+                snapshot = dict(cache)
+                self.__flush_timer = None
+            self.storage.write(snapshot)
+
+class JournalStorage(Storage):
+    """Keeps the database in memory and logs every change to an append-only journal.
+
+    Changes are committed in groups: a background thread writes everything that came in during
+    `commit_delay` seconds and fsyncs once. When the journal grows beyond `compact_size` bytes, the
+    whole database is written as a new snapshot (through an atomic rename) and the journal is
+    started over. On startup, the snapshot is loaded and the journal replayed on top of it.
+
+    The snapshot is a regular TinyDB JSON file, plus a `_journal` key holding the sequence number
+    of the last change it includes.
+    """
+
+    def __init__(self, path: str, commit_delay: float = 0.05, compact_size: int = 16 * 1024 * 1024) -> None:
+        super().__init__()
+        self.__path = path
+        self.__journal_path = '{}.journal'.format(path)
+        self.__old_journal_path = '{}.old'.format(self.__journal_path)
+        self.__commit_delay = commit_delay
+        self.__compact_size = compact_size
+        self.__lock = Lock()
+        self.__pending = []
+        self.__wake = Event()
+        self.__closing = False
+
+        self.__data, self.__seq = self.__load()
+        self.__tables = dict(self.__data)
+        if os.path.exists(self.__old_journal_path):
+            # We crashed while compacting last time. Finish the job before the old journal gets in the way.
+            self.__write_snapshot(dict(self.__data), self.__seq)
+            os.remove(self.__old_journal_path)
+        self.__journal = open(self.__journal_path, 'a', encoding='utf-8')
+        self.__committer = Thread(target=self.__run, daemon=True)
+        self.__committer.start()
+
+    def read(self) -> dict:
+        return self.__data
+
+    def write(self, data: dict) -> None:
+        with self.__lock:
+            self.__data = data
+            for entry in self.__diff(data):
+                self.__seq += 1
+                entry['seq'] = self.__seq
+                self.__pending.append(json.dumps(entry))
+            self.__tables = dict(data)
+        self.__wake.set()
+
+    def close(self) -> None:
+        self.__closing = True
+        self.__wake.set()
+        self.__committer.join()
+        self.__commit()
+        self.__compact()
+        self.__journal.close()
+
+    def __diff(self, data: dict) -> list:
+        entries = []
+        for name in self.__tables.keys() - data.keys():
+            entries.append({'table': name, 'drop': True})
+        for name, table in data.items():
+            old_table = self.__tables.get(name)
+            if table is old_table:
+                continue
+            # Document IDs are ints in TinyDB's cache, but strings once they've been through JSON.
+            old = {str(k): v for k, v in (old_table or {}).items()}
+            new = {str(k): v for k, v in table.items()}
+            changed = {k: v for k, v in new.items() if old.get(k) != v}
+            removed = list(old.keys() - new.keys())
+            if changed or removed or old_table is None:
+                entries.append({'table': name, 'set': changed, 'remove': removed})
+        return entries
+
+    def __run(self) -> None:
+        while not self.__closing:
+            self.__wake.wait()
+            self.__wake.clear()
+            # Give concurrent writes a moment to pile up, so they share one fsync.
+            if not self.__closing:
+                sleep(self.__commit_delay)
+            self.__commit()
+            if self.__journal.tell() > self.__compact_size:
+                self.__compact()
+
+    def __commit(self) -> None:
         with self.__lock:
-            self.storage.write(self.__cache)
-            self.__flush_timer = None
+            batch, self.__pending = self.__pending, []
+            if batch:
+                self.__journal.write(''.join(line + '\n' for line in batch))
+                self.__journal.flush()
+        if batch:
+            os.fsync(self.__journal.fileno())
+
+    def __compact(self) -> None:
+        # Move the journal aside, so changes coming in while the snapshot is written go to a new one.
+        # Both journals are replayed if we crash before the snapshot is in place.
+        with self.__lock:
+            self.__journal.close()
+            os.replace(self.__journal_path, self.__old_journal_path)
+            self.__journal = open(self.__journal_path, 'a', encoding='utf-8')
+            data, seq = dict(self.__data), self.__seq
+
+        self.__write_snapshot(data, seq)
+        os.remove(self.__old_journal_path)
+
+    def __write_snapshot(self, data: dict, seq: int) -> None:
+        data['_journal'] = seq
+        tmp = '{}.tmp'.format(self.__path)
+        with open(tmp, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, self.__path)
+
+    def __load(self) -> (dict, int):
+        data = {}
+        if os.path.exists(self.__path) and os.path.getsize(self.__path):
+            with open(self.__path, encoding='utf-8') as file:
+                data = json.load(file)
+        snapshot_seq = seq = data.pop('_journal', 0)
+
+        for path in (self.__old_journal_path, self.__journal_path):
+            if not os.path.exists(path):
+                continue
+            end = 0
+            with open(path, 'rb') as file:
+                for line in file:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('Incomplete line')
+                        entry = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        # Torn write at the end of the journal; nothing after it was committed.
+                        break
+                    end += len(line)
+                    if entry['seq'] <= snapshot_seq:
+                        continue
+                    seq = entry['seq']
+                    if entry.get('drop'):
+                        data.pop(entry['table'], None)
+                        continue
+                    table = data.setdefault(entry['table'], {})
+                    table.update(entry['set'])
+                    for doc_id in entry['remove']:
+                        table.pop(doc_id, None)
+            if end < os.path.getsize(path):
+                # Cut the torn write off, or the next entry appended would be glued to it and lost.
+                print('Discarding a torn write at the end of {}'.format(path))
+                os.truncate(path, end)
+
+        return data, seq
+
+class RawStorageProxy(StorageProxy):
+    def raw(self) -> dict:
+        """The table's documents as stored, without wrapping each of them in a Document."""
+        return (self._storage.read() or {}).get(self._table_name, {})
+
+def _equalities(hashval: tuple):
+    """Yield (field, value) for all top-level equality tests that a query's matches must pass."""
+    if hashval[0] == '==' and len(hashval[1]) == 1:
+        yield hashval[1][0], hashval[2]
+    elif hashval[0] == 'and':
+        for part in hashval[1]:
+            yield from _equalities(part)
+
+class IndexedTable(Table):
+    """Table keeping hash indexes on some fields, which equality queries use instead of a full scan.
+
+    Also offers lazy, bounded queries (`scan` and `query`) for tables without indexes.
+    """
+
+    def __init__(self, storage: RawStorageProxy, name: str, cache_size: int = 10, indexed_fields: tuple = ()) -> None:
+        self.__fields = indexed_fields
+        self.__index = None
+        self.__indexed = {}
+        super().__init__(storage, name, cache_size)
+
+    def insert(self, document: dict) -> int:
+        doc_id = super().insert(document)
+        self.__add(doc_id, document)
+        return doc_id
+
+    def insert_multiple(self, documents) -> list:
+        documents = list(documents)
+        doc_ids = super().insert_multiple(documents)
+        for doc_id, document in zip(doc_ids, documents):
+            self.__add(doc_id, document)
+        return doc_ids
+
+    def process_elements(self, func: callable, cond=None, doc_ids=None, eids=None) -> list:
+        if doc_ids is None and eids is None and cond is not None:
+            matches = self.__matches(cond)
+            if matches is not None:
+                doc_ids = [doc_id for doc_id, _ in matches]
+                if not doc_ids:
+                    return []
+        doc_ids = super().process_elements(func, cond, doc_ids, eids)
+        self.__reindex(doc_ids)
+        return doc_ids
+
+    def write_back(self, documents: list, doc_ids=None, eids=None) -> list:
+        doc_ids = super().write_back(documents, doc_ids, eids)
+        self.__reindex(doc_ids)
+        return doc_ids
+
+    def purge(self) -> None:
+        super().purge()
+        self.__index = None
+
+    def search(self, cond) -> list:
+        matches = self.__matches(cond)
+        if matches is None:
+            return super().search(cond)
+        return [Document(doc, doc_id) for doc_id, doc in matches]
+
+    def get(self, cond=None, doc_id=None, eid=None) -> Optional[Document]:
+        if cond is not None and doc_id is None and eid is None:
+            matches = self.__matches(cond)
+            if matches is not None:
+                return Document(matches[0][1], matches[0][0]) if matches else None
+        return super().get(cond, doc_id, eid)
+
+    def scan(self, cond=None, fields: tuple = None) -> Iterator[Document]:
+        """Lazily yield the documents matching `cond`, projected onto `fields` if given.
+
+        Documents are only looked at as the iterator advances, so taking a few matches of a large
+        table is cheap. Documents removed during the scan are skipped, added ones are not seen.
+        """
+        raw = self._storage.raw()
+        doc_ids = self.__candidates(cond) if cond is not None else None
+        walking = doc_ids is None
+        if walking:
+            # Walk the table itself rather than a copy of its IDs. TinyDB hands out IDs in increasing
+            # order, keeps tables in that order and replaces them on writes instead of changing them,
+            # so after a write the walk goes on in the new table, after the last ID it passed.
+            walked, last_id = raw, self._last_id
+            doc_ids = iter(raw)
+        else:
+            doc_ids = iter(doc_ids)
+        while True:
+            if walking and raw is not walked:
+                walked = raw
+                doc_ids = dropwhile(lambda doc_id, passed=int(doc_id): int(doc_id) <= passed, iter(raw))
+            doc_id = next(doc_ids, None)
+            if doc_id is None or walking and int(doc_id) > last_id:
+                return
+            doc = self.__raw_doc(raw, doc_id)
+            if doc is None or (cond is not None and not cond(doc)):
+                continue
+            if fields is not None:
+                doc = {field: doc[field] for field in fields if field in doc}
+            yield Document(doc, int(doc_id))
+            # The table may have been written to while we were paused.
+            raw = self._storage.raw()
+
+    def query(self, cond=None, limit: int = None, offset: int = 0, fields: tuple = None) -> list:
+        """Return at most `limit` matches of `cond` after skipping `offset`, without looking further."""
+        return list(islice(self.scan(cond, fields), offset, None if limit is None else offset + limit))
+
+    def __candidates(self, cond) -> Optional[list]:
+        """Return the sorted IDs of documents that may match `cond`, or None if no index applies."""
+        if not self.__fields:
+            return None
+        index = self.__get_index()
+        candidates = None
+        for field, value in _equalities(cond.hashval):
+            if field in index:
+                doc_ids = index[field].get(value, ())
+                if candidates is None or len(doc_ids) < len(candidates):
+                    candidates = doc_ids
+        return None if candidates is None else sorted(candidates)
+
+    def __matches(self, cond) -> Optional[list]:
+        """Return (doc_id, document) for all matches of `cond`, or None if no index applies."""
+        candidates = self.__candidates(cond)
+        if candidates is None:
+            return None
+
+        raw = self._storage.raw()
+        matches = []
+        for doc_id in candidates:
+            doc = self.__raw_doc(raw, doc_id)
+            if doc is not None and cond(doc):
+                matches.append((doc_id, doc))
+        return matches
+
+    def __get_index(self) -> dict:
+        if self.__index is None:
+            self.__index = {field: defaultdict(set) for field in self.__fields}
+            self.__indexed = {}
+            for doc_id, doc in self._storage.raw().items():
+                self.__add(int(doc_id), doc)
+        return self.__index
+
+    def __add(self, doc_id: int, doc: dict) -> None:
+        if self.__index is None:
+            return
+        values = {field: freeze(doc[field]) for field in self.__fields if field in doc}
+        for field, value in values.items():
+            self.__index[field][value].add(doc_id)
+        self.__indexed[doc_id] = values
+
+    def __reindex(self, doc_ids: list) -> None:
+        if self.__index is None:
+            return
+        raw = self._storage.raw()
+        for doc_id in doc_ids:
+            for field, value in self.__indexed.pop(doc_id, {}).items():
+                ids = self.__index[field][value]
+                ids.discard(doc_id)
+                if not ids:
+                    del self.__index[field][value]
+            doc = self.__raw_doc(raw, doc_id)
+            if doc is not None:
+                self.__add(doc_id, doc)
+
+    @staticmethod
+    def __raw_doc(raw: dict, doc_id: int) -> Optional[dict]:
+        # Document IDs are ints once TinyDB wrote the table, but strings when freshly loaded from JSON.
+        doc = raw.get(doc_id)
+        return doc if doc is not None else raw.get(str(doc_id))
 
 class DB(TinyDB):
-    def __init__(self, path: str) -> None:
-        super().__init__(path, storage=LockingCachingMiddleware(TinyDB.DEFAULT_STORAGE))
+    storage_proxy_class = RawStorageProxy
+
+    def __init__(self, path: str, journaled: bool = False, indexes: dict = None) -> None:
+        """`indexes` maps table names to the fields to keep hash indexes on."""
+        self.__indexes = indexes or {}
+        if journaled:
+            super().__init__(path, storage=JournalStorage)
+        else:
+            super().__init__(path, storage=LockingCachingMiddleware(TinyDB.DEFAULT_STORAGE))
+
+    def table(self, name: str = TinyDB.DEFAULT_TABLE, **options) -> Table:
+        if 'table_class' not in options:
+            options.update(table_class=IndexedTable, indexed_fields=tuple(self.__indexes.get(name, ())))
+        return super().table(name, **options)
@@ -0,0 +1,172 @@
+import asyncio
+from collections import Counter, deque
+from typing import Optional
+
+class TokenBucket():
+    """Allows `rate` events per `per` seconds, refilling continuously."""
+
+    def __init__(self, rate: int, per: float, now: float) -> None:
+        self.__rate = rate
+        self.__per = per
+        self.__tokens = float(rate)
+        self.__updated = now
+        self.__blocked_until = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available."""
+        self.__tokens = min(self.__rate, self.__tokens + (now - self.__updated) * self.__rate / self.__per)
+        self.__updated = now
+        return max(self.__blocked_until - now, (1 - self.__tokens) * self.__per / self.__rate, 0)
+
+    def is_full(self, now: float) -> bool:
+        return self.wait_time(now) == 0 and self.__tokens >= self.__rate
+
+    def take(self) -> None:
+        self.__tokens -= 1
+
+    def block(self, now: float, seconds: float) -> None:
+        """Hand out no tokens for `seconds`, like after the server told us to back off."""
+        self.__tokens = 0
+        self.__updated = now
+        self.__blocked_until = max(self.__blocked_until, now + seconds)
+
+class _Message():
+    def __init__(self, destination, content, kwargs: dict, coalesce, future: asyncio.Future) -> None:
+        self.destination = destination
+        self.content = content
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.future = future
+        self.attempts = 0
+
+class _Channel():
+    def __init__(self, bucket: TokenBucket) -> None:
+        self.bucket = bucket
+        self.queue = deque()
+        self.recent = {}
+        self.worker = None
+
+def _retry_after(error: Exception):
+    """Return (seconds to back off, whether the limit is global) if `error` is a rate limit response."""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status', None) != 429:
+        return None, False
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        retry_after = float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        retry_after = 1.0
+    return retry_after, 'X-RateLimit-Global' in headers
+
+class Outbox():
+    """Sends messages through `send`, keeping within Discord's rate limits instead of running into them.
+
+    Every channel has its own queue and token bucket (Discord allows 5 messages per 5 seconds per
+    channel), all channels share a global bucket, and channels are drained concurrently. Messages
+    with the same `coalesce` key are sent at most once per channel and window: while one is queued,
+    or within `coalesce_window` seconds after it was sent, further ones are dropped.
+    """
+
+    def __init__(self, send, loop: asyncio.AbstractEventLoop, channel_rate: int = 5, channel_per: float = 5.0,
+                 global_rate: int = 50, global_per: float = 1.0, coalesce_window: float = 5.0,
+                 max_attempts: int = 5) -> None:
+        self.__send = send
+        self.__loop = loop
+        self.__channel_rate = channel_rate
+        self.__channel_per = channel_per
+        self.__global = TokenBucket(global_rate, global_per, loop.time())
+        self.__coalesce_window = coalesce_window
+        self.__max_attempts = max_attempts
+        self.__channels = {}
+        self.__stats = Counter()
+
+    @property
+    def stats(self) -> Counter:
+        """Counts of messages sent, coalesced and rate limited, and of failed sends."""
+        return self.__stats
+
+    def send(self, destination, content=None, coalesce=None, **kwargs) -> asyncio.Future:
+        """Queue a message; the future resolves to what `send` returned, or None if it was coalesced."""
+        if coalesce is not None:
+            future = self.coalesced(destination, coalesce)
+            if future is not None:
+                return future
+
+        key = getattr(destination, 'id', destination)
+        channel = self.__channels.get(key)
+        if channel is None:
+            channel = self.__channels[key] = _Channel(
+                TokenBucket(self.__channel_rate, self.__channel_per, self.__loop.time())
+            )
+        message = _Message(destination, content, kwargs, coalesce, self.__loop.create_future())
+        channel.queue.append(message)
+        if channel.worker is None:
+            channel.worker = asyncio.ensure_future(self.__drain(key, channel), loop=self.__loop)
+        return message.future
+
+    def coalesced(self, destination, coalesce) -> Optional[asyncio.Future]:
+        """If a message to `destination` with key `coalesce` would be dropped now, count it as coalesced
+        and return the future that send() would have. Lets callers skip preparing such a message."""
+        channel = self.__channels.get(getattr(destination, 'id', destination))
+        if channel is None:
+            return None
+        for message in channel.queue:
+            if message.coalesce == coalesce:
+                self.__stats['coalesced'] += 1
+                return message.future
+        sent_at = channel.recent.get(coalesce)
+        if sent_at is not None and self.__loop.time() - sent_at < self.__coalesce_window:
+            self.__stats['coalesced'] += 1
+            future = self.__loop.create_future()
+            future.set_result(None)
+            return future
+        return None
+
+    async def __drain(self, key, channel: _Channel) -> None:
+        try:
+            while channel.queue:
+                now = self.__loop.time()
+                wait = max(channel.bucket.wait_time(now), self.__global.wait_time(now))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                channel.bucket.take()
+                self.__global.take()
+
+                message = channel.queue[0]
+                message.attempts += 1
+                try:
+                    result = await self.__send(message.destination, message.content, **message.kwargs)
+                except Exception as e:
+                    retry_after, is_global = _retry_after(e)
+                    if retry_after is not None and message.attempts < self.__max_attempts:
+                        self.__stats['rate_limited'] += 1
+                        (self.__global if is_global else channel.bucket).block(self.__loop.time(), retry_after)
+                        continue
+                    self.__stats['failed'] += 1
+                    channel.queue.popleft()
+                    if not message.future.done():
+                        message.future.set_exception(e)
+                    continue
+
+                channel.queue.popleft()
+                self.__stats['sent'] += 1
+                if message.coalesce is not None:
+                    channel.recent[message.coalesce] = self.__loop.time()
+                if not message.future.done():
+                    message.future.set_result(result)
+        finally:
+            channel.worker = None
+            self.__forget(key)
+
+    def __forget(self, key) -> None:
+        """Drop the state of an idle channel once it no longer affects what can be sent."""
+        channel = self.__channels.get(key)
+        if channel is None or channel.worker is not None:
+            return
+        now = self.__loop.time()
+        channel.recent = {k: t for k, t in channel.recent.items() if now - t < self.__coalesce_window}
+        if channel.recent or not channel.bucket.is_full(now):
+            self.__loop.call_later(max(self.__coalesce_window, self.__channel_per), self.__forget, key)
+        else:
+            del self.__channels[key]
@@ -0,0 +1,70 @@
+from collections import defaultdict
+from typing import Optional
+
+from tinydb.database import Table
+
+class PhraseIndex():
+    """In-memory view of the phrases table, grouped by phrase set.
+
+    The table stays the source of truth; whoever changes it tells the index what changed.
+    """
+
+    def __init__(self, table: Table) -> None:
+        self.__table = table
+        self.reload()
+
+    def reload(self) -> None:
+        sets = defaultdict(list)
+        positions = {}
+        for row in self.__table.all():
+            positions[row['content']] = (row['set'], len(sets[row['set']]))
+            sets[row['set']].append(row['content'])
+        self.__sets, self.__positions = sets, positions
+        self.__snapshots = {}
+
+    def phrases(self, phrase_set: str) -> tuple:
+        # Pickers only rebuild their state when they get a different object, so hand out
+        # the same tuple until the set changes.
+        snapshot = self.__snapshots.get(phrase_set)
+        if snapshot is None:
+            snapshot = self.__snapshots[phrase_set] = tuple(self.__sets.get(phrase_set, ()))
+        return snapshot
+
+    def set_of(self, content: str) -> Optional[str]:
+        position = self.__positions.get(content)
+        return position and position[0]
+
+    def add(self, phrase_set: str, content: str) -> None:
+        self.remove(content)
+        phrases = self.__sets[phrase_set]
+        self.__positions[content] = (phrase_set, len(phrases))
+        phrases.append(content)
+        self.__snapshots.pop(phrase_set, None)
+
+    def remove(self, content: str) -> None:
+        position = self.__positions.pop(content, None)
+        if position is None:
+            return
+        phrase_set, i = position
+        # Swap with the last phrase of the set, so removal doesn't shift the whole list.
+        phrases = self.__sets[phrase_set]
+        last = phrases.pop()
+        if i < len(phrases):
+            phrases[i] = last
+            self.__positions[last] = (phrase_set, i)
+        if not phrases:
+            del self.__sets[phrase_set]
+        self.__snapshots.pop(phrase_set, None)
+
+    def move(self, content: str, phrase_set: str) -> None:
+        if content in self.__positions:
+            self.add(phrase_set, content)
+
+    def move_set(self, old_set: str, new_set: str) -> None:
+        for content in list(self.__sets.get(old_set, [])):
+            self.add(new_set, content)
+
+    def remove_set(self, phrase_set: str) -> None:
+        for content in self.__sets.pop(phrase_set, []):
+            del self.__positions[content]
+        self.__snapshots.pop(phrase_set, None)
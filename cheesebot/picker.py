@@ -1,33 +1,70 @@
-from math import ceil
-from random import choice
-from typing import Any
+from collections import deque
+from random import random, randrange
+from typing import Any, Sequence
 
 class Picker():
     def __init__(self) -> None:
-        self.__last_used = []
+        self.__items = None
+        self.__pool = []
+        self.__last_used = deque()
+        self.__weights = {}
+        self.__max_weight = None
 
-    def _all_items(self) -> list:
+    def _all_items(self) -> Sequence:
+        """Return all items to pick from.
+
+        Picking is O(1) as long as the same sequence object is returned; returning a different
+        object makes the next pick rebuild the bag in O(n), so only do that when items changed.
+        """
         raise NotImplementedError('Don\'t use Picker directly, use subclasses.')
 
+    def _weight(self, item: Any) -> float:
+        """Relative (positive) chance of `item` being picked among the items that aren't blocked."""
+        return 1
+
     def pick(self) -> Any:
-        all_items = set(self._all_items())
+        all_items = self._all_items()
+        if all_items is not self.__items:
+            self.__sync(all_items)
 
         # No sound effect found :(
-        if len(all_items) == 0:
+        if not self.__pool and not self.__last_used:
             return None
 
         # Make sure that at most half of the sound effects are blocked from playing next.
         # In particular:
-        # - If there is only 1 sound effect, ceil(1 - 0.5) = 1 will always be removed.
+        # - If there is only 1 sound effect, it will always be released again.
         # - If there are two SEs, only one item will be disabled (they will be played in turn).
         # - If there are three SEs, only direct repetition will be prevented.
-        to_remove = ceil(len(self.__last_used) - len(all_items) / 2)
-        if to_remove > 0:
-            self.__last_used = self.__last_used[to_remove:]
+        while len(self.__last_used) > (len(self.__pool) + len(self.__last_used)) // 2:
+            self.__pool.append(self.__last_used.popleft())
 
-        item = choice(list(all_items.difference(self.__last_used)))
+        # Rejection sampling keeps weighted picks O(1) on average, as long as weights are
+        # within a reasonable range of each other.
+        pool = self.__pool
+        while True:
+            i = randrange(len(pool))
+            item = pool[i]
+            if self.__max_weight is None or random() * self.__max_weight < self.__weights[item]:
+                break
 
         # Don't play this sound effect again next time.
+        pool[i] = pool[-1]
+        pool.pop()
         self.__last_used.append(item)
 
         return item
+
+    def __sync(self, all_items: Sequence) -> None:
+        items = set(all_items)
+        weights = {item: self._weight(item) for item in items}
+        for item, weight in weights.items():
+            if not weight > 0:
+                # Picking would never end if only such items were left to pick from.
+                raise ValueError('Weights must be positive, got {} for {!r}.'.format(weight, item))
+        self.__items = all_items
+        self.__last_used = deque(item for item in self.__last_used if item in items)
+        self.__pool = list(items.difference(self.__last_used))
+        self.__weights = weights
+        distinct = set(weights.values())
+        self.__max_weight = max(distinct) if len(distinct) > 1 else None
@@ -0,0 +1,145 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+import logging
+import os
+import sys
+from threading import Event, Thread, enumerate as threads, get_ident
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0
+
+class StackSampler(Thread):
+    """Records the stacks of all other threads every `interval` seconds, in collapsed form."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        super().__init__(name='stack sampler', daemon=True)
+        self.__interval = interval
+        self.__stop = Event()
+        self.stacks = Counter()
+        self.samples = 0
+
+    def run(self) -> None:
+        own = get_ident()
+        while not self.__stop.wait(self.__interval):
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread {}'.format(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self.__stop.set()
+        self.join()
+
+class _SlowCallbacks(logging.Handler):
+    """Collects asyncio's debug mode warnings about callbacks that blocked the loop."""
+
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if not message.startswith('Executing'):
+            return
+        # Leave out what the task is waiting for, which is mostly noise.
+        if ' wait_for=' in message and ' took ' in message:
+            message = '{}> took {}'.format(message[:message.index(' wait_for=')], message.rsplit(' took ', 1)[1])
+        self.messages.append(message)
+
+class ProfileReport():
+    def __init__(self, path: str, seconds: float, sampler: StackSampler, lags: list, slow_callbacks: list) -> None:
+        self.path = path
+        self.seconds = seconds
+        self.samples = sampler.samples
+        self.lags = lags
+        self.slow_callbacks = slow_callbacks
+        # Where each thread spent its time, by innermost frame
+        self.hot_frames = Counter()
+        for stack, count in sampler.stacks.items():
+            frames = stack.split(';')
+            self.hot_frames['{}: {}'.format(frames[0], frames[-1])] += count
+
+    def __str__(self):
+        lines = [
+            'Profiled {:.1f} s, {} samples, written to {}'.format(self.seconds, self.samples, self.path),
+            'Event loop lag: p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+                percentile(self.lags, .5) * 1e3, percentile(self.lags, .99) * 1e3, max(self.lags or [0]) * 1e3
+            ),
+            '{} slow callbacks{}'.format(len(self.slow_callbacks), ':' if self.slow_callbacks else ''),
+        ]
+        lines.extend('    {}'.format(message) for message in self.slow_callbacks[:5])
+        lines.append('Hottest frames:')
+        lines.extend('    {:5.1f}% {}'.format(100 * count / max(self.samples, 1), frame)
+                     for frame, count in self.hot_frames.most_common(8))
+        return '\n'.join(lines)
+
+class Profiler():
+    """Samples all threads' stacks, the event loop's lag and its slow callbacks while it runs.
+
+    Nothing is hooked or running in between, so it costs nothing unless used. Stacks are written
+    in the collapsed format flamegraph tools read, to a new file in `output_dir` per run.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, output_dir: str) -> None:
+        self.__loop = loop
+        self.__output_dir = output_dir
+        self.__stopped = None
+
+    @property
+    def running(self) -> bool:
+        return self.__stopped is not None
+
+    def stop(self) -> None:
+        if self.__stopped is not None:
+            self.__stopped.set()
+
+    async def run(self, seconds: float, interval: float = 0.005, lag_interval: float = 0.1,
+                  slow_callback: float = 0.05) -> ProfileReport:
+        """Profile for `seconds`, or until stop() is called."""
+        assert not self.running, 'Already profiling.'
+        self.__stopped = asyncio.Event()
+        start = self.__loop.time()
+
+        sampler = StackSampler(interval)
+        sampler.start()
+        lags = []
+        monitor = self.__loop.create_task(self.__monitor_lag(lag_interval, lags))
+        slow_callbacks = _SlowCallbacks()
+        logger = logging.getLogger('asyncio')
+        logger.addHandler(slow_callbacks)
+        debug, slow_callback_duration = self.__loop.get_debug(), self.__loop.slow_callback_duration
+        self.__loop.slow_callback_duration = slow_callback
+        self.__loop.set_debug(True)
+        try:
+            await asyncio.wait_for(self.__stopped.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.__loop.set_debug(debug)
+            self.__loop.slow_callback_duration = slow_callback_duration
+            logger.removeHandler(slow_callbacks)
+            monitor.cancel()
+            await self.__loop.run_in_executor(None, sampler.stop)
+            self.__stopped = None
+
+        os.makedirs(self.__output_dir, exist_ok=True)
+        path = os.path.join(self.__output_dir, 'profile-{:%Y%m%d-%H%M%S-%f}.folded'.format(datetime.now()))
+        with open(path, 'w', encoding='utf-8') as file:
+            file.writelines('{} {}\n'.format(stack, count) for stack, count in sampler.stacks.items())
+        return ProfileReport(path, self.__loop.time() - start, sampler, lags, slow_callbacks.messages)
+
+    async def __monitor_lag(self, interval: float, lags: list) -> None:
+        while True:
+            start = self.__loop.time()
+            await asyncio.sleep(interval)
+            lags.append(self.__loop.time() - start - interval)
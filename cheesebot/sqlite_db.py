@@ -0,0 +1,258 @@
+from itertools import islice
+import json
+import os
+import re
+import sqlite3
+from threading import RLock
+from typing import Iterator, Optional
+
+from tinydb import TinyDB
+from tinydb.database import Document
+from tinydb.storages import JSONStorage
+
+from .db import JournalStorage
+
+# Fields we put into SQL ourselves; anything else is only checked in Python.
+_FIELD = re.compile(r'\w+')
+_BATCH_SIZE = 256
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+def _column(path: tuple) -> Optional[str]:
+    """The SQL expression for a document field, which is also what its index is built on."""
+    if not path or not all(isinstance(part, str) and _FIELD.fullmatch(part) for part in path):
+        return None
+    return 'json_extract(doc, \'$.{}\')'.format('.'.join('"{}"'.format(part) for part in path))
+
+def _where(hashval) -> (Optional[str], list, bool):
+    """Translate a TinyDB query to SQL as far as possible.
+
+    Returns the condition, its parameters and whether it is exact. An inexact condition only
+    narrows down the candidates, which still need to be tested with the query itself.
+    """
+    if hashval is None:
+        return None, [], False
+    op = hashval[0]
+    if op == 'path' and hashval[1] == ():
+        # The empty Query(), which the admin commands start from, matches everything.
+        return '1', [], True
+    if op == '==' and type(hashval[2]) in (str, int, float):
+        column = _column(hashval[1])
+        if column is not None and not (type(hashval[2]) is int and not -2 ** 63 <= hashval[2] < 2 ** 63):
+            return '{} = ?'.format(column), [hashval[2]], True
+    if op in ('and', 'or'):
+        parts = [_where(part) for part in hashval[1]]
+        translated = [part for part in parts if part[0] is not None]
+        if not translated or (op == 'or' and len(translated) < len(parts)):
+            return None, [], False
+        sql = ' {} '.format(op.upper()).join('({})'.format(part[0]) for part in translated)
+        params = [param for part in translated for param in part[1]]
+        return sql, params, len(translated) == len(parts) and all(part[2] for part in translated)
+    return None, [], False
+
+class SQLiteTable():
+    """The parts of TinyDB's Table API that the bot uses, on an SQLite table of JSON documents.
+
+    Equality tests in queries are done in SQL, using an index where there is one. Whatever cannot
+    be translated is checked in Python on the rows SQL returned.
+    """
+
+    def __init__(self, connection: sqlite3.Connection, lock: RLock, name: str, indexed_fields: tuple = ()) -> None:
+        self.__connection = connection
+        self.__lock = lock
+        self.__name = name
+        self.__table = _quote(name)
+        with self.__lock, self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(
+                self.__table, 'doc_id INTEGER PRIMARY KEY AUTOINCREMENT, doc TEXT NOT NULL'
+            ))
+            for field in indexed_fields:
+                self.__connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                    _quote('{}.{}'.format(name, field)), self.__table, _column((field,))
+                ))
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM {}'.format(self.__table)).fetchone()[0]
+
+    def all(self) -> list:
+        return list(self.scan())
+
+    def search(self, cond) -> list:
+        return list(self.scan(cond))
+
+    def get(self, cond=None, doc_id: int = None) -> Optional[Document]:
+        if doc_id is not None:
+            with self.__lock:
+                row = self.__connection.execute(
+                    'SELECT doc FROM {} WHERE doc_id = ?'.format(self.__table), (doc_id,)
+                ).fetchone()
+            return row and Document(json.loads(row[0]), doc_id)
+        return next(self.scan(cond), None)
+
+    def contains(self, cond=None, doc_ids: list = None) -> bool:
+        if doc_ids is not None:
+            return any(self.get(doc_id=doc_id) is not None for doc_id in doc_ids)
+        return self.get(cond) is not None
+
+    def insert(self, document: dict) -> int:
+        return self.insert_multiple([document])[0]
+
+    def insert_multiple(self, documents) -> list:
+        sql = 'INSERT INTO {} (doc) VALUES (?)'.format(self.__table)
+        with self.__lock, self.__connection:
+            return [self.__connection.execute(sql, (json.dumps(document),)).lastrowid for document in documents]
+
+    def restore(self, documents: dict) -> None:
+        """Insert documents under the IDs they are mapped to, like when migrating from TinyDB."""
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                'INSERT OR REPLACE INTO {} (doc_id, doc) VALUES (?, ?)'.format(self.__table),
+                ((int(doc_id), json.dumps(document)) for doc_id, document in documents.items())
+            )
+
+    def update(self, fields, cond=None, doc_ids: list = None) -> list:
+        """Update matching documents with a dict of fields, or a function changing a document in place."""
+        with self.__lock, self.__connection:
+            matches = self.__matches(cond, doc_ids)
+            for _, document in matches:
+                if callable(fields):
+                    fields(document)
+                else:
+                    document.update(fields)
+            self.__connection.executemany(
+                'UPDATE {} SET doc = ? WHERE doc_id = ?'.format(self.__table),
+                ((json.dumps(document), doc_id) for doc_id, document in matches)
+            )
+        return [doc_id for doc_id, _ in matches]
+
+    def remove(self, cond=None, doc_ids: list = None) -> list:
+        with self.__lock, self.__connection:
+            doc_ids = [doc_id for doc_id, _ in self.__matches(cond, doc_ids)]
+            self.__connection.executemany(
+                'DELETE FROM {} WHERE doc_id = ?'.format(self.__table), ((doc_id,) for doc_id in doc_ids)
+            )
+        return doc_ids
+
+    def upsert(self, document: dict, cond) -> list:
+        with self.__lock:
+            updated = self.update(document, cond)
+            return updated or [self.insert(document)]
+
+    def purge(self) -> None:
+        with self.__lock, self.__connection:
+            self.__connection.execute('DELETE FROM {}'.format(self.__table))
+
+    def scan(self, cond=None, fields: tuple = None) -> Iterator[Document]:
+        """Lazily yield the documents matching `cond`, projected onto `fields` if given.
+
+        Rows are fetched in small batches, continuing after the last document ID seen, so a
+        paused scan neither holds the database nor starts over.
+        """
+        sql, params, exact = self.__condition(cond)
+        after = 0
+        while True:
+            with self.__lock:
+                rows = self.__connection.execute(
+                    'SELECT doc_id, doc FROM {} WHERE doc_id > ? AND ({}) ORDER BY doc_id LIMIT ?'
+                    .format(self.__table, sql), [after] + params + [_BATCH_SIZE]
+                ).fetchall()
+            for doc_id, doc in rows:
+                document = json.loads(doc)
+                if exact or cond(document):
+                    if fields is not None:
+                        document = {field: document[field] for field in fields if field in document}
+                    yield Document(document, doc_id)
+            if len(rows) < _BATCH_SIZE:
+                return
+            after = rows[-1][0]
+
+    def query(self, cond=None, limit: int = None, offset: int = 0, fields: tuple = None) -> list:
+        """Return at most `limit` matches of `cond` after skipping `offset`, without looking further."""
+        sql, params, exact = self.__condition(cond)
+        if not exact:
+            return list(islice(self.scan(cond, fields), offset, None if limit is None else offset + limit))
+
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT doc_id, doc FROM {} WHERE {} ORDER BY doc_id LIMIT ? OFFSET ?'.format(self.__table, sql),
+                params + [-1 if limit is None else limit, offset]
+            ).fetchall()
+        documents = []
+        for doc_id, doc in rows:
+            document = json.loads(doc)
+            if fields is not None:
+                document = {field: document[field] for field in fields if field in document}
+            documents.append(Document(document, doc_id))
+        return documents
+
+    def __condition(self, cond) -> (str, list, bool):
+        if cond is None:
+            return '1', [], True
+        sql, params, exact = _where(getattr(cond, 'hashval', None))
+        return sql or '1', params, exact
+
+    def __matches(self, cond, doc_ids: list) -> list:
+        """Return (doc_id, document) for the given documents, or those matching `cond`."""
+        if doc_ids is not None:
+            documents = (self.get(doc_id=doc_id) for doc_id in doc_ids)
+            return [(document.doc_id, dict(document)) for document in documents if document is not None]
+        return [(document.doc_id, dict(document)) for document in self.scan(cond)]
+
+class SQLiteDB():
+    """Alternative to DB that keeps every table in SQLite, instead of the whole database in memory.
+
+    Offers the same tables with the same API as far as the bot uses it. `indexes` maps table
+    names to the fields to index, like for DB.
+    """
+
+    def __init__(self, path: str, indexes: dict = None) -> None:
+        self.__indexes = indexes or {}
+        self.__lock = RLock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute('PRAGMA journal_mode = WAL')
+        self.__connection.execute('PRAGMA synchronous = NORMAL')
+        self.__tables = {}
+
+    def table(self, name: str = TinyDB.DEFAULT_TABLE) -> SQLiteTable:
+        table = self.__tables.get(name)
+        if table is None:
+            table = self.__tables[name] = SQLiteTable(
+                self.__connection, self.__lock, name, tuple(self.__indexes.get(name, ()))
+            )
+        return table
+
+    def tables(self) -> set:
+        with self.__lock:
+            rows = self.__connection.execute(
+                'SELECT name FROM sqlite_master WHERE type = \'table\' AND name NOT LIKE \'sqlite_%\''
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__connection.close()
+
+def migrate(json_path: str, sqlite_path: str, indexes: dict = None) -> None:
+    """Copy the TinyDB database at `json_path` (journaled or not) into a new SQLite database."""
+    storage = JournalStorage(json_path) if os.path.exists('{}.journal'.format(json_path)) else JSONStorage(json_path)
+    try:
+        data = storage.read() or {}
+    finally:
+        storage.close()
+
+    # Build the database under another name, so a failed migration can simply be run again.
+    temp_path = '{}.migrating'.format(sqlite_path)
+    for path in (temp_path, '{}-wal'.format(temp_path), '{}-shm'.format(temp_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    db = SQLiteDB(temp_path, indexes)
+    for name, documents in data.items():
+        db.table(name).restore(documents)
+    db.close()
+    os.replace(temp_path, sqlite_path)
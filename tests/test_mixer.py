@@ -0,0 +1,52 @@
+from io import BytesIO
+import random
+import struct
+import unittest
+import warnings
+
+from cheesebot.cogs.audio.streams import Mixer, MultiStream
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+def pcm(*samples) -> bytes:
+    return struct.pack('<{}h'.format(len(samples)), *samples)
+
+def audioop_mix(samples: list, size: int) -> bytes:
+    """How MultiStream mixed before numpy: pad, scale and add one sample at a time."""
+    data = bytes(size)
+    for sample, gain in samples:
+        sample = bytes(sample) + bytes(size - len(sample))
+        data = audioop.add(data, audioop.mul(sample, 2, gain), 2)
+    return data
+
+class MixerTest(unittest.TestCase):
+    def test_partial_sums_are_clipped(self):
+        # Three loud streams end in the same frame as a fourth keeps playing, which gives gains of
+        # 1/3, 1/2, 1/2 and 1/2. The first three add up past 32767, and the fourth pulls the sum
+        # back down; clipping only at the end would give 27304.
+        stream = MultiStream()
+        for _ in range(3):
+            stream.add_stream(BytesIO(pcm(32767, 32767)))
+        stream.add_stream(BytesIO(pcm(*[-32768] * 8)))
+        self.assertEqual(bytes(stream.read(8)), pcm(16383, 16383, -16384, -16384))
+
+    @unittest.skipIf(audioop is None, 'audioop is not available')
+    def test_same_as_audioop(self):
+        rng = random.Random(0)
+        mixer = Mixer()
+        size = 64
+        for _ in range(200):
+            samples = [
+                (pcm(*(rng.choice((-32768, 32767, rng.randint(-32768, 32767))) for _ in range(rng.randint(0, size // 2)))),
+                 rng.choice((1.0, 0.5, 1 / 3, 0.25)))
+                for _ in range(rng.randint(1, 5))
+            ]
+            self.assertEqual(mixer.mix(samples, size), audioop_mix(samples, size))
+
+if __name__ == '__main__':
+    unittest.main()
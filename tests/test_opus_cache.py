@@ -0,0 +1,96 @@
+import ctypes
+from os.path import join
+from tempfile import TemporaryDirectory
+import unittest
+from unittest import mock
+
+import numpy
+
+from cheesebot.cogs.audio import opus_cache
+from cheesebot.cogs.audio.opus_cache import OpusCache
+from cheesebot.cogs.audio.streams import FRAME_SIZE, CircularStream, MultiStream
+
+FRAMES = 25
+
+def sine(frames: int, amplitude: int = 16000) -> bytes:
+    """A 440 Hz tone on both channels, as 48 kHz 16 bit stereo PCM."""
+    t = numpy.arange(frames * FRAME_SIZE // 4) / 48000
+    mono = (amplitude * numpy.sin(2 * numpy.pi * 440 * t)).astype(numpy.int16)
+    return numpy.repeat(mono, 2).tobytes()
+
+def live_frames(pcm: bytes, frames: int) -> list:
+    """The frames MultiStream mixes from `pcm` looping on its own, without pre-encoded packets."""
+    stream = MultiStream().add_stream(CircularStream(pcm, FRAME_SIZE), source='bgm')
+    return [bytes(stream.read(FRAME_SIZE)) for _ in range(frames)]
+
+def build(tmp: str, pcm: bytes) -> OpusCache:
+    source = join(tmp, 'stream.raw')
+    with open(source, 'wb') as file:
+        file.write(pcm)
+    return OpusCache.load_or_build(source, pcm, FRAME_SIZE)
+
+def opus_decoder():
+    """A function decoding an Opus packet to int16 samples with the library discord.py loaded, or None."""
+    from discord import opus
+    if not getattr(opus, 'is_loaded', lambda: False)():
+        return None
+    lib = opus._lib
+    lib.opus_decoder_create.restype = ctypes.c_void_p
+    lib.opus_decoder_create.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    lib.opus_decode.restype = ctypes.c_int
+    lib.opus_decode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int32,
+                                ctypes.POINTER(ctypes.c_int16), ctypes.c_int, ctypes.c_int]
+    error = ctypes.c_int()
+    decoder = lib.opus_decoder_create(48000, 2, ctypes.byref(error))
+    samples = FRAME_SIZE // 4
+
+    def decode(packet) -> numpy.ndarray:
+        pcm = (ctypes.c_int16 * (samples * 2))()
+        count = lib.opus_decode(decoder, bytes(packet), len(packet), pcm, samples, 0)
+        return numpy.array(pcm[:count * 2], numpy.int16)
+    return decode
+
+def rms(samples) -> float:
+    return float(numpy.sqrt(numpy.mean(numpy.asarray(samples, numpy.float64) ** 2)))
+
+class PassThroughEncoder():
+    """Encodes a frame as its own PCM, so a cached packet can be compared byte for byte."""
+
+    def __init__(self, rate: int, channels: int) -> None:
+        pass
+
+    def encode(self, pcm: bytes, frame_size: int) -> bytes:
+        return pcm
+
+class OpusCacheTest(unittest.TestCase):
+    def test_cached_frames_match_the_live_lone_bgm(self):
+        pcm = sine(FRAMES)
+        with TemporaryDirectory() as tmp, mock.patch.object(opus_cache, 'Encoder', PassThroughEncoder):
+            cache = build(tmp, pcm)
+            live = live_frames(pcm, FRAMES)
+            self.assertEqual(len(cache), FRAMES)
+            for i in range(FRAMES):
+                self.assertEqual(bytes(cache[i]), live[i], 'frame {}'.format(i))
+
+    def test_cache_built_at_another_gain_is_stale(self):
+        pcm = sine(FRAMES)
+        with TemporaryDirectory() as tmp, mock.patch.object(opus_cache, 'Encoder', PassThroughEncoder):
+            cache = build(tmp, pcm)
+            cache.gain = 1.0
+            self.assertFalse(cache.is_fresh_for(join(tmp, 'stream.raw'), FRAME_SIZE))
+
+    def test_decoded_cached_frames_are_as_loud_as_live_ones(self):
+        decode = opus_decoder()
+        if decode is None:
+            self.skipTest('the Opus library is not loaded')
+        pcm = sine(FRAMES)
+        with TemporaryDirectory() as tmp:
+            cache = build(tmp, pcm)
+            decoded = [decode(cache[i]) for i in range(len(cache))]
+        live = [numpy.frombuffer(frame, numpy.int16) for frame in live_frames(pcm, FRAMES)]
+        # Skip the first frames, which the encoder's lookahead delays; a steady tone's level doesn't move.
+        ratio = rms(numpy.concatenate(decoded[5:])) / rms(numpy.concatenate(live[5:]))
+        self.assertAlmostEqual(ratio, 1, delta=0.1)
+
+if __name__ == '__main__':
+    unittest.main()